@@ -4,20 +4,50 @@ Backfill metadata for existing images
 Run this once to create metadata entries for all existing uploads
 """
 
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
 # Add venv to path
 sys.path.insert(0, '/var/www/vibe-screenshots/venv/lib/python3.12/site-packages')
 
-from PIL import Image
-import pillow_heif
+from image_io import get_dimensions
+from metadata_store import MetadataStore, CONTENT_TYPES, IMAGE_EXTENSIONS
 
-# Register HEIF opener
-pillow_heif.register_heif_opener()
+# Print a progress line every this many processed files
+PROGRESS_EVERY = 500
 
-from metadata_store import MetadataStore
+# Threads for header probing (I/O-bound, so oversubscribe the cores)
+BACKFILL_WORKERS = min(32, (os.cpu_count() or 1) * 2)
+
+def _probe(entry: os.DirEntry) -> dict:
+    """Build the backfill metadata entry for one image"""
+    # Get image info from the header bytes only
+    width, height = get_dimensions(entry.path)
+
+    # Get file size (the only stat() for this file; DirEntry caches it)
+    size_bytes = entry.stat(follow_symlinks=False).st_size
+
+    # Determine content type from the (already filtered) extension
+    content_type = CONTENT_TYPES[os.path.splitext(entry.name)[1].lower()]
+
+    # Using current timestamp as fallback
+    return MetadataStore.build_entry(
+        original_filename=entry.name,  # We don't know the original
+        size_bytes=size_bytes,
+        dimensions=(width, height),
+        content_type=content_type,
+        additional_data={"backfilled": True}  # Mark as backfilled
+    )
+
+def _safe_probe(entry: os.DirEntry):
+    """Run _probe in a worker, returning (entry, metadata, error)"""
+    try:
+        return entry, _probe(entry), None
+    except Exception as e:
+        return entry, None, e
 
 def backfill_existing_images():
     """Create metadata entries for all existing images"""
@@ -27,66 +57,62 @@ def backfill_existing_images():
         print(f"❌ Error: {source_dir} directory not found")
         return
 
-    store = MetadataStore(source_dir)
-    existing_metadata = store.get_all_metadata()
-
-    # Image extensions to process
-    image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.heic', '.heif'}
-
-    # Files to skip
-    skip_files = {'lister.py', 'index.html', 'image_widths_heights.json', 'uploads_metadata.json'}
-
-    processed = 0
-    skipped = 0
-    errors = 0
-
-    print(f"🔍 Scanning {source_dir} for images...")
-
-    for file_path in sorted(source_dir.iterdir()):
-        # Skip if not a file or in skip list
-        if not file_path.is_file() or file_path.name in skip_files:
-            continue
-
-        # Skip if not an image extension
-        if file_path.suffix.lower() not in image_extensions:
-            continue
-
-        # Skip if already has metadata
-        if file_path.name in existing_metadata:
-            print(f"⏭️  Skipped (already has metadata): {file_path.name}")
-            skipped += 1
-            continue
-
-        try:
-            # Get image info
-            with Image.open(file_path) as img:
-                width, height = img.size
-                format_type = img.format.lower() if img.format else 'unknown'
-
-            # Get file size
-            size_bytes = file_path.stat().st_size
-
-            # Determine content type
-            content_type = f"image/{format_type}"
-            if format_type == 'jpeg':
-                content_type = "image/jpeg"
-
-            # Record metadata (using current timestamp as fallback)
-            store.record_upload(
-                filename=file_path.name,
-                original_filename=file_path.name,  # We don't know the original
-                size_bytes=size_bytes,
-                dimensions=(width, height),
-                content_type=content_type,
-                additional_data={"backfilled": True}  # Mark as backfilled
-            )
-
-            print(f"✅ Added metadata: {file_path.name} ({width}x{height}, {size_bytes:,} bytes)")
-            processed += 1
-
-        except Exception as e:
-            print(f"❌ Error processing {file_path.name}: {e}")
-            errors += 1
+    # A single read for the whole run; anything left pending is flushed on exit
+    with MetadataStore(source_dir) as store:
+        existing_metadata = store.list_filenames()
+
+        # Files to skip
+        skip_files = {'lister.py', 'index.html', 'image_widths_heights.json', 'uploads_metadata.json'}
+
+        processed = 0
+        skipped = 0
+        errors = 0
+        new_entries: dict[str, dict] = {}
+
+        print(f"🔍 Scanning {source_dir} for images...")
+
+        # os.scandir gives us name and file type from the directory read
+        # itself; walk it unsorted and only order the (filtered) candidates
+        candidates = []
+        with os.scandir(source_dir) as it:
+            for entry in it:
+                # Skip if not a file or in skip list (d_type from the directory
+                # read answers is_file without a stat call)
+                if not entry.is_file(follow_symlinks=False) or entry.name in skip_files:
+                    continue
+
+                # Skip if not an image extension
+                if not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+
+                # Skip if already has metadata
+                if entry.name in existing_metadata:
+                    skipped += 1
+                    continue
+
+                candidates.append(entry)
+
+        candidates.sort(key=lambda e: e.name)
+        print(f"   {len(candidates)} to process, {skipped} already have metadata")
+
+        # Header reads are independent and mostly blocking I/O, so fan them
+        # out over a thread pool; only this thread touches the store.
+        with ThreadPoolExecutor(max_workers=BACKFILL_WORKERS) as executor:
+            for entry, meta, error in executor.map(_safe_probe, candidates):
+                if error is not None:
+                    print(f"❌ Error processing {entry.name}: {error}")
+                    errors += 1
+                    continue
+
+                new_entries[entry.name] = meta
+                processed += 1
+
+                # One progress line per batch rather than one print per file
+                if processed % PROGRESS_EVERY == 0:
+                    print(f"   ... {processed}/{len(candidates)} processed")
+
+        # One merge and one JSON write for the whole batch
+        store.bulk_record(new_entries)
 
     print(f"\n📊 Summary:")
     print(f"   Processed: {processed}")
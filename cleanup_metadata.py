@@ -4,20 +4,21 @@ Cleanup utility for metadata synchronization
 Removes orphaned entries and ensures all metadata is in sync with actual files
 """
 
+import os
 import sys
 import json
-import subprocess
 from pathlib import Path
 
 # Add venv to path
 sys.path.insert(0, '/var/www/vibe-screenshots/venv/lib/python3.12/site-packages')
 
-from PIL import Image
-import pillow_heif
-from metadata_store import MetadataStore
+# Importing image_io also registers the HEIF opener once for this process
+from image_io import remove_orphaned_thumbnails
+from metadata_store import MetadataStore, IMAGE_EXTENSIONS, json_loads
 
-# Register HEIF opener
-pillow_heif.register_heif_opener()
+# lister.py lives in the gallery's source/ directory next to this script
+sys.path.insert(0, str(Path(__file__).resolve().parent / "source"))
+from lister import regenerate_widths_heights
 
 def cleanup_all_metadata(source_dir: Path, verbose: bool = True) -> dict:
     """
@@ -28,6 +29,7 @@ def cleanup_all_metadata(source_dir: Path, verbose: bool = True) -> dict:
     """
     stats = {
         'uploads_metadata_removed': 0,
+        'thumbnails_removed': 0,
         'image_widths_heights_regenerated': False,
         'total_images': 0,
         'errors': []
@@ -46,11 +48,21 @@ def cleanup_all_metadata(source_dir: Path, verbose: bool = True) -> dict:
         removed = store.cleanup_orphaned_metadata()
         stats['uploads_metadata_removed'] = removed
 
+        # Thumbnails of deleted images would otherwise stay servable
+        stats['thumbnails_removed'] = remove_orphaned_thumbnails(source_dir)
+
+        # Drop superseded records and tombstones from the append-only log;
+        # safe while the servers run (they append under the same flock and
+        # re-read the log once it's replaced)
+        store.compact()
+
         if verbose:
             if removed > 0:
                 print(f"   ✅ Removed {removed} orphaned entries")
             else:
                 print("   ✅ No orphaned entries found")
+            if stats['thumbnails_removed'] > 0:
+                print(f"   ✅ Removed {stats['thumbnails_removed']} orphaned thumbnails")
     except Exception as e:
         error_msg = f"Error cleaning uploads_metadata.json: {e}"
         stats['errors'].append(error_msg)
@@ -61,32 +73,19 @@ def cleanup_all_metadata(source_dir: Path, verbose: bool = True) -> dict:
     if verbose:
         print("\n🔄 Step 2: Regenerating image_widths_heights.json...")
 
+    images = None
     try:
-        result = subprocess.run(
-            [sys.executable, "lister.py"],
-            cwd=source_dir,
-            capture_output=True,
-            text=True,
-            check=True
-        )
+        # Runs in-process: no interpreter start-up or Pillow re-import
+        images = regenerate_widths_heights(source_dir)
 
         stats['image_widths_heights_regenerated'] = True
+        stats['total_images'] = len(images)
 
         if verbose:
-            print(f"   ✅ {result.stdout.strip()}")
+            print(f"   ✅ Successfully created image_widths_heights.json with {len(images)} files.")
 
-        # Count actual images
-        with open(source_dir / "image_widths_heights.json", 'r') as f:
-            images = json.load(f)
-            stats['total_images'] = len(images)
-
-    except subprocess.CalledProcessError as e:
-        error_msg = f"Error regenerating image_widths_heights.json: {e.stderr}"
-        stats['errors'].append(error_msg)
-        if verbose:
-            print(f"   ❌ {error_msg}")
     except Exception as e:
-        error_msg = f"Unexpected error: {e}"
+        error_msg = f"Error regenerating image_widths_heights.json: {e}"
         stats['errors'].append(error_msg)
         if verbose:
             print(f"   ❌ {error_msg}")
@@ -97,23 +96,24 @@ def cleanup_all_metadata(source_dir: Path, verbose: bool = True) -> dict:
 
     try:
         # Get list from uploads_metadata.json
-        metadata_files = set(store.get_all_metadata().keys())
-
-        # Get list from image_widths_heights.json
-        with open(source_dir / "image_widths_heights.json", 'r') as f:
-            image_list_files = set(img for img, _ in json.load(f))
+        metadata_files = store.list_filenames()
 
         # Get actual files on disk
-        image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.heic', '.heif'}
-        actual_files = {
-            f.name for f in source_dir.iterdir()
-            if f.is_file() and f.suffix.lower() in image_extensions
-        }
-
-        # Check for mismatches
+        with os.scandir(source_dir) as it:
+            actual_files = {
+                e.name for e in it
+                if e.is_file() and e.name.lower().endswith(IMAGE_EXTENSIONS)
+            }
+
+        # Check for mismatches. Set differences already run in C; the image
+        # list is filtered in one pass rather than built into a third set.
         only_in_metadata = metadata_files - actual_files
-        only_in_image_list = image_list_files - actual_files
         only_on_disk = actual_files - metadata_files
+        if images is None:
+            # Regeneration failed; verify whatever list is on disk
+            with open(source_dir / "image_widths_heights.json", 'rb') as f:
+                images = json_loads(f.read())
+        only_in_image_list = {img for img, _ in images if img not in actual_files}
 
         if verbose:
             if only_in_metadata:
@@ -176,6 +176,7 @@ def main():
         print("=" * 80)
         print(f"Total images: {stats['total_images']}")
         print(f"Orphaned entries removed: {stats['uploads_metadata_removed']}")
+        print(f"Orphaned thumbnails removed: {stats['thumbnails_removed']}")
         print(f"Image list regenerated: {'Yes' if stats['image_widths_heights_regenerated'] else 'No'}")
         if stats['errors']:
             print(f"Errors: {len(stats['errors'])}")
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Gallery layout
+Scatters images over the page without overlaps, so browsers only have to
+place <img> tags at precomputed coordinates
+"""
+
+import random
+from typing import List, Tuple
+
+# Images are scaled down towards roughly this many pixels
+GOAL_PIXELS = 500 * 300
+
+# Placement starts in a band this tall and grows it when an image won't fit
+START_HEIGHT = 600
+HEIGHT_STEP = 50
+
+# Random positions tried per image before growing the band
+ATTEMPTS = 50
+
+def display_size(width: int, height: int, screen_width: int) -> Tuple[int, int]:
+    """Scale an image down by 2, 4 or 8 depending on how large it is"""
+    ratio = width * height / GOAL_PIXELS
+    if ratio > 16:
+        divisor = 8
+    elif ratio > 4:
+        divisor = 4
+    else:
+        divisor = 2
+    w, h = width // divisor, height // divisor
+    if w + 10 > screen_width:
+        w = screen_width - 10
+    return w, h
+
+def layout_images(images: List[list], screen_width: int, seed: int) -> List[list]:
+    """
+    Shuffle images and place each at a random spot that overlaps no earlier one
+
+    images is the /api/images listing ([name, [width, height]] pairs); returns
+    [name, [x, y, w, h]] in placement order. The same seed gives the same layout.
+    """
+    rng = random.Random(seed)
+    order = list(images)
+    rng.shuffle(order)
+    sizes = [display_size(width, height, screen_width) for _, (width, height) in order]
+    if not sizes:
+        return []
+
+    # Spatial hash: each placed rect is filed under every grid cell it touches,
+    # so a candidate is only tested against rects in its own few cells
+    cell = max(1, sorted(w for w, _ in sizes)[len(sizes) // 2])
+    grid = {}
+
+    layout = []
+    last_band = START_HEIGHT
+    for (name, _), (w, h) in zip(order, sizes):
+        # Bands far above where the previous image fit are almost surely full;
+        # start just below them rather than re-growing from the top each time
+        band = max(START_HEIGHT, h, last_band - START_HEIGHT)
+        while True:
+            w_max = screen_width - w
+            h_max = band - h
+            for _ in range(ATTEMPTS):
+                a_left = rng.random() * w_max
+                a_top = rng.random() * h_max
+                a_right = a_left + w
+                a_bottom = a_top + h
+                if not _collides(grid, cell, a_left, a_top, a_right, a_bottom):
+                    break
+            else:
+                band += HEIGHT_STEP
+                continue
+            break
+
+        last_band = band
+        x, y = int(a_left), int(a_top)
+        rect = (x, y, x + w, y + h)
+        for key in _cells(cell, *rect):
+            grid.setdefault(key, []).append(rect)
+        layout.append([name, [x, y, w, h]])
+
+    return layout
+
+def _cells(cell, left, top, right, bottom):
+    """Grid cells covered by a rect"""
+    for cx in range(int(left // cell), int(right // cell) + 1):
+        for cy in range(int(top // cell), int(bottom // cell) + 1):
+            yield cx, cy
+
+def _collides(grid, cell, a_left, a_top, a_right, a_bottom):
+    """True if the rect overlaps any rect already in the grid"""
+    for key in _cells(cell, a_left, a_top, a_right, a_bottom):
+        for b_left, b_top, b_right, b_bottom in grid.get(key, ()):
+            if a_left < b_right and a_right > b_left and a_bottom > b_top and a_top < b_bottom:
+                return True
+    return False
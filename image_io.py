@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Shared image helpers
+Registers the HEIF opener once and reads image sizes from file headers
+
+Sizes are reported as displayed, i.e. after the EXIF Orientation tag is
+applied, to match browsers and the thumbnails make_thumbnail() writes.
+"""
+
+import os
+import struct
+import threading
+from typing import Optional
+
+from PIL import Image, ImageOps
+import pillow_heif
+
+# Register HEIF opener (once per process, for everything that imports us)
+pillow_heif.register_heif_opener()
+
+# Gallery thumbnails fit in this box (about 2x the largest display size)
+THUMBNAIL_SIZE = (1024, 1024)
+THUMBNAIL_QUALITY = 80
+
+# Thumbnails live in this subdirectory of the images, as <original name>.webp
+THUMBNAIL_DIRNAME = "thumbs"
+
+# JPEG start-of-frame markers (SOF0-SOF15, minus DHT/JPG/DAC)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                    0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# Format each image extension is expected to contain, as named by probe_image
+EXTENSION_FORMATS = {
+    '.jpg': 'jpeg', '.jpeg': 'jpeg', '.png': 'png', '.gif': 'gif',
+    '.bmp': 'bmp', '.webp': 'webp', '.heic': 'heif', '.heif': 'heif',
+}
+
+# EXIF Orientation tag; values 5-8 rotate by 90 degrees, swapping the axes
+EXIF_ORIENTATION = 0x0112
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+# WebP VP8X header flag set when the file carries an EXIF chunk
+WEBP_EXIF_FLAG = 0x08
+
+# ISO-BMFF major brands used by HEIC/HEIF stills and sequences
+HEIF_BRANDS = {b'heic', b'heix', b'heim', b'heis', b'hevc', b'hevx',
+               b'mif1', b'msf1'}
+
+def detect_format(head: bytes) -> Optional[str]:
+    """Identify an image from its first 32 bytes by magic number, or None"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    if head[4:8] == b'ftyp' and head[8:12] in HEIF_BRANDS:
+        return 'heif'
+    if head[:2] == b'BM':
+        return 'bmp'
+    return None
+
+def _exif_orientation(exif: bytes) -> int:
+    """Orientation from a raw APP1 Exif payload; 1 (as stored) if absent"""
+    order = {b'II': '<', b'MM': '>'}.get(exif[6:8])
+    if not exif.startswith(b'Exif\x00\x00') or order is None:
+        return 1
+    tiff = exif[6:]
+    try:
+        ifd = struct.unpack(order + 'I', tiff[4:8])[0]
+        count = struct.unpack(order + 'H', tiff[ifd:ifd + 2])[0]
+        for i in range(count):
+            start = ifd + 2 + 12 * i
+            tag, _, _, value = struct.unpack(order + 'HHIH2x', tiff[start:start + 12])
+            if tag == EXIF_ORIENTATION:
+                return value
+    except struct.error:
+        pass  # truncated IFD
+    return 1
+
+def _oriented(width, height, orientation):
+    """Displayed size of a width x height image with this EXIF orientation"""
+    if orientation in TRANSPOSED_ORIENTATIONS:
+        return height, width
+    return width, height
+
+def _jpeg_dimensions(f):
+    """
+    Walk JPEG segments up to the SOF marker, seeking over everything but the
+    Exif block (read for its Orientation tag)
+    """
+    if f.read(2) != b'\xff\xd8':
+        return None
+    orientation = None
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return None
+        if byte != b'\xff':
+            continue
+        marker = f.read(1)
+        while marker == b'\xff':  # fill bytes
+            marker = f.read(1)
+        if not marker:
+            return None
+        code = marker[0]
+        if code == 0x01 or 0xD0 <= code <= 0xD9:
+            continue  # standalone markers have no length
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack('>H', length_bytes)[0]
+        if code in JPEG_SOF_MARKERS:
+            segment = f.read(5)
+            if len(segment) < 5:
+                return None
+            height, width = struct.unpack('>xHH', segment)
+            return _oriented(width, height, orientation)
+        if code == 0xE1 and orientation is None:
+            # APP1; only the first Exif block counts, as in browsers
+            segment = f.read(length - 2)
+            if segment.startswith(b'Exif\x00\x00'):
+                orientation = _exif_orientation(segment)
+            continue
+        f.seek(length - 2, os.SEEK_CUR)
+
+def _webp_dimensions(head: bytes):
+    """Read the canvas size from the first chunk of a RIFF/WEBP file"""
+    chunk = head[12:16]
+    if chunk == b'VP8 ' and head[23:26] == b'\x9d\x01\x2a':
+        width, height = struct.unpack('<HH', head[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L' and head[20:21] == b'\x2f':
+        bits = struct.unpack('<I', head[21:25])[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X':
+        if head[20] & WEBP_EXIF_FLAG:
+            return None  # may be rotated; let PIL read the EXIF chunk
+        width = int.from_bytes(head[24:27], 'little') + 1
+        height = int.from_bytes(head[27:30], 'little') + 1
+        return width, height
+    return None
+
+def probe_image(path) -> tuple[int, int, str]:
+    """
+    Get (width, height, format) from the file header only, dispatching on
+    the file's magic number (so temp files without an extension work too).
+
+    Parses a few hundred bytes for JPEG/PNG/GIF/BMP/WebP and reads only the
+    HEIF container (no pixel decode) for HEIC; anything else falls back to PIL.
+    """
+    dims = None
+    with open(path, 'rb') as f:
+        head = f.read(32)
+        format_type = detect_format(head)
+        if format_type == 'jpeg':
+            f.seek(0)
+            dims = _jpeg_dimensions(f)
+        elif format_type == 'png' and head[12:16] == b'IHDR':
+            dims = struct.unpack('>II', head[16:24])
+        elif format_type == 'gif':
+            dims = struct.unpack('<HH', head[6:10])
+        elif format_type == 'bmp' and len(head) >= 26:
+            if struct.unpack('<I', head[14:18])[0] == 12:
+                dims = struct.unpack('<HH', head[18:22])
+            else:
+                width, height = struct.unpack('<ii', head[18:26])
+                dims = (width, abs(height))
+        elif format_type == 'webp':
+            dims = _webp_dimensions(head)
+
+    if format_type == 'heif':
+        # open_heif parses the container lazily; pixels are only decoded on access
+        return (*pillow_heif.open_heif(path).size, 'heif')
+
+    if dims is None:
+        # Unknown or unusual layout: let PIL read the header
+        with Image.open(path) as img:
+            dims = _oriented(*img.size, img.getexif().get(EXIF_ORIENTATION))
+            format_type = img.format.lower() if img.format else 'unknown'
+
+    return dims[0], dims[1], format_type
+
+def get_dimensions(path) -> tuple[int, int]:
+    """Get (width, height) of an image without decoding its pixels"""
+    width, height, _ = probe_image(path)
+    return width, height
+
+def verify_image(path) -> tuple[int, int]:
+    """
+    Fully check an image and return its (width, height)
+
+    Unlike get_dimensions this runs PIL's verify() pass (libheif's container
+    parse for HEIF). Module-level, so it can run in a process pool.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(32)
+    if detect_format(head) == 'heif':
+        # libheif validates the container directly, without PIL's plugin layer
+        return pillow_heif.open_heif(path).size
+    with Image.open(path) as img:
+        dimensions = _oriented(*img.size, img.getexif().get(EXIF_ORIENTATION))
+        img.verify()
+    return dimensions
+
+def make_thumbnail(src, dest, size=THUMBNAIL_SIZE):
+    """Write a WebP copy of src scaled down to fit size, atomically, to dest"""
+    with Image.open(src) as img:
+        # Let the JPEG decoder downscale by 1/2..1/8 while decoding
+        img.draft('RGB', (size[0] * 2, size[1] * 2))
+        # Bake the EXIF rotation in: the WebP carries no EXIF of its own
+        img = ImageOps.exif_transpose(img)
+        img = img.convert('RGBA' if img.mode in ('RGBA', 'LA', 'P', 'PA') else 'RGB')
+        img.thumbnail(size, Image.LANCZOS)
+        tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            img.save(tmp, 'WEBP', quality=THUMBNAIL_QUALITY, method=4)
+            os.replace(tmp, dest)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+def remove_orphaned_thumbnails(source_dir) -> int:
+    """Delete thumbnails whose original is no longer in source_dir; returns the count"""
+    thumb_dir = os.path.join(source_dir, THUMBNAIL_DIRNAME)
+    # Thumbnails first: uploads write the original before its thumbnail, so
+    # one that lands between the two scans is never mistaken for an orphan
+    try:
+        with os.scandir(thumb_dir) as it:
+            thumbs = [e.name for e in it if e.name.endswith('.webp') and e.is_file()]
+    except FileNotFoundError:
+        return 0
+    with os.scandir(source_dir) as it:
+        originals = {e.name for e in it if e.is_file()}
+
+    removed = 0
+    for thumb in thumbs:
+        if thumb.removesuffix('.webp') not in originals:
+            try:
+                os.unlink(os.path.join(thumb_dir, thumb))
+                removed += 1
+            except FileNotFoundError:
+                pass  # removed by another worker
+    return removed
@@ -5,39 +5,359 @@ Tracks upload timestamp and other metadata for future extensibility
 """
 
 import json
+import mmap
 import os
+import re
 from pathlib import Path
 from datetime import datetime
 from typing import Dict, Any, Optional
 import threading
+from contextlib import contextmanager
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib
+    orjson = None
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+def json_loads(data: bytes) -> Any:
+    """Parse JSON bytes, using orjson when available"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(data: Any, pretty: bool = False) -> bytes:
+    """Serialize to JSON bytes, using orjson when available"""
+    if orjson is not None:
+        option = orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS if pretty else 0
+        return orjson.dumps(data, option=option)
+    if pretty:
+        return json.dumps(data, indent=2, sort_keys=True).encode('utf-8')
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+# Image file extensions (lowercase) recognised across the tools; a tuple so
+# callers can test a lowercased name with str.endswith in one call
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.heic', '.heif')
+
+# The same extensions without the dot, for set lookups on name.rpartition('.')
+IMAGE_SUFFIXES = frozenset(ext[1:] for ext in IMAGE_EXTENSIONS)
+
+# MIME type for each image extension
+CONTENT_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.bmp': 'image/bmp',
+    '.webp': 'image/webp',
+    '.heic': 'image/heic',
+    '.heif': 'image/heif',
+}
+
+# Log records are written compactly with "filename" as the first key, so the
+# names (and tombstones) can be pulled from the raw bytes without parsing entries
+_LOG_FILENAME_RE = re.compile(
+    rb'^\{"filename":"((?:[^"\\]|\\.)*)"(,"deleted":true\})?', re.MULTILINE
+)
+
 
 class MetadataStore:
-    """Thread-safe metadata storage for uploaded images"""
+    """
+    Thread-safe metadata storage for uploaded images
+
+    The source of truth is an append-only log (uploads_metadata.jsonl) with
+    one record per line, so each upload costs a single small write. The
+    latest value per filename wins and {"deleted": true} records are
+    tombstones. uploads_metadata.json is kept as an exported view of the
+    current state for existing readers and is refreshed on flush().
+
+    The in-memory state is an immutable snapshot dict: writers build a new
+    dict under self.lock and rebind it, readers just grab the reference and
+    never block. Disk writes of the JSON view happen outside self.lock.
+
+    Several processes (server workers, the cleanup CLI) may share one
+    directory. Appends, view writes and compaction hold an flock on
+    .uploads_metadata.lock, and every read first checks the log's inode and
+    size, replaying records other processes appended (or the whole log after
+    a compaction) before answering.
+    """
 
     def __init__(self, storage_path: Path):
         self.storage_path = storage_path
         self.metadata_file = storage_path / "uploads_metadata.json"
+        self.log_file = storage_path / "uploads_metadata.jsonl"
+        self.lock_file = storage_path / ".uploads_metadata.lock"
         self.lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._snapshot: Optional[Dict[str, Any]] = None
+        # Log version the snapshot reflects: inode, size seen, bytes replayed
+        self._log_ino = None
+        self._log_size = 0
+        self._log_offset = 0
+        self._dirty = False
         self._ensure_file_exists()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    @contextmanager
+    def _process_lock(self):
+        """
+        Exclusive across processes and threads (each call opens its own
+        descriptor); take it before self.lock, and never nest it
+        """
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_file, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
     def _ensure_file_exists(self):
-        """Create metadata file if it doesn't exist"""
-        if not self.metadata_file.exists():
-            with self.lock:
+        """Create the log (seeded from an existing JSON view) if needed"""
+        with self._process_lock(), self.lock:
+            if not self.metadata_file.exists():
                 self.metadata_file.write_text("{}")
+            if not self.log_file.exists():
+                try:
+                    with open(self.metadata_file, 'rb') as f:
+                        existing = json_loads(f.read())
+                except ValueError:
+                    existing = {}
+                self._write_log(existing)
+
+    @staticmethod
+    def _log_line(filename: str, entry: Dict[str, Any]) -> bytes:
+        """Serialize one log record, filename first"""
+        return json_dumps({"filename": filename, **entry}) + b"\n"
+
+    @staticmethod
+    def _atomic_write(path: Path, payload: bytes):
+        """
+        Write to a temp file next to path, fsync it, then rename it into place
+
+        A crash leaves either the old or the new file, never a truncated one.
+        """
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    def _write_log(self, data: Dict[str, Any]):
+        """
+        Rewrite the log with one record per current entry; caller must hold
+        the process lock and self.lock
+        """
+        payload = b"".join(self._log_line(name, entry) for name, entry in data.items())
+        self._atomic_write(self.log_file, payload)
+        st = os.stat(self.log_file)
+        self._snapshot = dict(data)
+        self._log_ino, self._log_size, self._log_offset = st.st_ino, st.st_size, st.st_size
+
+    def _append_log(self, records: list[bytes]):
+        """
+        Append serialized records with a single write() call; caller must hold
+        the process lock and self.lock, with the snapshot (if any) refreshed
+        """
+        with open(self.log_file, 'a+b') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size and os.pread(f.fileno(), 1, size - 1) != b"\n":
+                # Terminate a partial line left by an interrupted append
+                records = [b"\n", *records]
+            f.write(b"".join(records))
+            f.flush()
+            st = os.fstat(f.fileno())
+        if self._snapshot is not None:
+            # Nothing else can append while the process lock is held, so once
+            # the caller applies these records the snapshot covers the whole log
+            self._log_ino, self._log_size, self._log_offset = st.st_ino, st.st_size, st.st_size
+
+    def _log_changed(self) -> bool:
+        """True if the log differs from the version the snapshot reflects"""
+        try:
+            st = os.stat(self.log_file)
+        except FileNotFoundError:
+            return self._log_ino is not None
+        return (st.st_ino, st.st_size) != (self._log_ino, self._log_size)
 
     def _read_metadata(self) -> Dict[str, Any]:
-        """Read metadata from file"""
+        """
+        Bring the snapshot up to date with the log and return it; caller must
+        hold self.lock
+
+        Only records appended since the last call are replayed, unless the log
+        was replaced (compacted) or shrank, which triggers a full replay. A
+        trailing line without a newline is left for the next call: it is
+        either an append still being written or a torn one that the next
+        append will terminate.
+        """
+        try:
+            f = open(self.log_file, 'rb')
+        except FileNotFoundError:
+            if self._snapshot is None or self._log_ino is not None:
+                self._snapshot = {}
+                self._log_ino, self._log_size, self._log_offset = None, 0, 0
+            return self._snapshot
+
+        with f:
+            st = os.fstat(f.fileno())
+            if self._snapshot is not None and (st.st_ino, st.st_size) == (self._log_ino, self._log_size):
+                return self._snapshot
+            if self._snapshot is None or st.st_ino != self._log_ino or st.st_size < self._log_offset:
+                metadata, offset = {}, 0
+            else:
+                metadata, offset = dict(self._snapshot), self._log_offset
+            f.seek(offset)
+            data = f.read(st.st_size - offset)
+
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            try:
+                record = json_loads(line)
+            except ValueError:
+                continue  # torn line from an interrupted append
+            if not isinstance(record, dict):
+                continue
+            filename = record.pop("filename", None)
+            if filename is None:
+                continue
+            if record.get("deleted"):
+                metadata.pop(filename, None)
+            else:
+                metadata[filename] = record
+
+        self._snapshot = metadata
+        self._log_ino, self._log_size, self._log_offset = st.st_ino, st.st_size, offset + end
+        return metadata
+
+    def _current(self) -> Dict[str, Any]:
+        """Current snapshot; one stat() per call, the lock only if the log moved"""
+        snapshot = self._snapshot
+        if snapshot is None or self._log_changed():
+            with self.lock:
+                snapshot = self._read_metadata()
+        return snapshot
+
+    def _list_filenames(self) -> set[str]:
+        """Filenames with live metadata; caller must hold self.lock"""
+        if self._snapshot is not None:
+            return set(self._read_metadata())
+
+        names = set()
         try:
-            with open(self.metadata_file, 'r') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return {}
+            with open(self.log_file, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return names
+                # Scan the mapped file in place instead of copying it into a bytes object
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    # Like the full replay, ignore lines cut short by an
+                    # interrupted append: the unterminated last one, and any
+                    # that don't end in a closing brace
+                    end = mm.rfind(b"\n") + 1
+                    for match in _LOG_FILENAME_RE.finditer(mm, 0, end):
+                        line_end = mm.find(b"\n", match.end(), end)
+                        if line_end < 0 or mm[line_end - 1] != ord("}"):
+                            continue
+                        raw = match.group(1)
+                        if b'\\' in raw:
+                            name = json_loads(b'"' + raw + b'"')
+                        else:
+                            name = raw.decode('utf-8')
+                        if match.group(2):
+                            names.discard(name)
+                        else:
+                            names.add(name)
+        except FileNotFoundError:
+            pass
+        return names
+
+    def list_filenames(self) -> set[str]:
+        """Get the set of filenames with metadata without parsing the entries"""
+        if self._snapshot is not None:
+            return set(self._current())
+        with self.lock:
+            return self._list_filenames()
+
+    def _write_metadata(self, data: Dict[str, Any], pretty: bool = False):
+        """Write the JSON view (compact unless pretty is requested)"""
+        # Serialize once and hand the buffer to a single write() call
+        self._atomic_write(self.metadata_file, json_dumps(data, pretty=pretty))
 
-    def _write_metadata(self, data: Dict[str, Any]):
-        """Write metadata to file"""
-        with open(self.metadata_file, 'w') as f:
-            json.dump(data, f, indent=2, sort_keys=True)
+    def export_pretty(self):
+        """Rewrite the JSON view indented with sorted keys, for humans"""
+        with self._flush_lock, self._process_lock():
+            with self.lock:
+                snapshot = self._read_metadata()
+                self._dirty = False
+            self._write_metadata(snapshot, pretty=True)
+
+    def flush(self):
+        """Refresh the JSON view if this store has changed the log since the last write"""
+        # _flush_lock keeps this process's view writes ordered; the process
+        # lock orders them against other processes and, since the snapshot is
+        # refreshed under it, the view written includes their records too.
+        # self.lock is only held long enough to take the latest snapshot
+        with self._flush_lock:
+            if not self._dirty:
+                return
+            with self._process_lock():
+                with self.lock:
+                    snapshot = self._read_metadata()
+                    self._dirty = False
+                self._write_metadata(snapshot)
+
+    def compact(self):
+        """Rewrite the log without superseded records or tombstones"""
+        # The process lock keeps appends from other processes out of the old
+        # log while it is being replaced; they re-read the new one by inode
+        with self._flush_lock, self._process_lock():
+            with self.lock:
+                snapshot = self._read_metadata()
+                self._write_log(snapshot)
+                self._dirty = False
+            self._write_metadata(snapshot)
+
+    @staticmethod
+    def build_entry(
+        original_filename: str,
+        size_bytes: int,
+        dimensions: tuple[int, int],
+        content_type: str,
+        additional_data: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Build a metadata entry without touching the store"""
+        entry = {
+            "uploaded_at": datetime.utcnow().isoformat() + "Z",
+            "original_filename": original_filename,
+            "size_bytes": size_bytes,
+            "dimensions": list(dimensions),
+            "content_type": content_type
+        }
+
+        # Add any additional metadata
+        if additional_data:
+            entry.update(additional_data)
+
+        return entry
 
     def record_upload(
         self,
@@ -52,70 +372,92 @@ class MetadataStore:
         Record metadata for an uploaded image
 
         Args:
-            filename: UUID-based filename stored on disk
+            filename: Content-hash filename stored on disk
             original_filename: Original filename from upload
             size_bytes: File size in bytes
             dimensions: (width, height) tuple
             content_type: MIME type
             additional_data: Optional dict of extra metadata
         """
-        with self.lock:
-            metadata = self._read_metadata()
+        entry = self.build_entry(
+            original_filename, size_bytes, dimensions, content_type, additional_data
+        )
 
-            entry = {
-                "uploaded_at": datetime.utcnow().isoformat() + "Z",
-                "original_filename": original_filename,
-                "size_bytes": size_bytes,
-                "dimensions": list(dimensions),
-                "content_type": content_type
-            }
+        with self._process_lock(), self.lock:
+            snapshot = self._read_metadata()
+            self._append_log([self._log_line(filename, entry)])
+            self._snapshot = {**snapshot, filename: entry}
+            self._dirty = True
 
-            # Add any additional metadata
-            if additional_data:
-                entry.update(additional_data)
+    def bulk_record(self, entries: Dict[str, Dict[str, Any]]):
+        """
+        Merge many entries (filename -> entry from build_entry) with one append
+        """
+        if not entries:
+            return
 
-            metadata[filename] = entry
-            self._write_metadata(metadata)
+        # Sorted so the log and the exported view stay deterministic
+        names = sorted(entries)
+        with self._process_lock(), self.lock:
+            snapshot = self._read_metadata()
+            self._append_log([self._log_line(name, entries[name]) for name in names])
+            updated = dict(snapshot)
+            for filename in names:
+                updated[filename] = entries[filename]
+            self._snapshot = updated
+            self._dirty = True
 
     def get_metadata(self, filename: str) -> Optional[Dict[str, Any]]:
         """Get metadata for a specific file"""
-        with self.lock:
-            metadata = self._read_metadata()
-            return metadata.get(filename)
+        return self._current().get(filename)
 
     def get_all_metadata(self) -> Dict[str, Any]:
-        """Get all metadata"""
-        with self.lock:
-            return self._read_metadata()
+        """Get all metadata (a read-only snapshot; do not mutate)"""
+        return self._current()
 
     def delete_metadata(self, filename: str):
         """Delete metadata for a specific file"""
-        with self.lock:
-            metadata = self._read_metadata()
-            if filename in metadata:
-                del metadata[filename]
-                self._write_metadata(metadata)
+        with self._process_lock(), self.lock:
+            snapshot = self._read_metadata()
+            if filename in snapshot:
+                self._append_log([self._log_line(filename, {"deleted": True})])
+                self._snapshot = {k: v for k, v in snapshot.items() if k != filename}
+                self._dirty = True
 
     def cleanup_orphaned_metadata(self) -> int:
         """
         Remove metadata entries for files that no longer exist
         Returns number of entries cleaned up
         """
-        with self.lock:
-            metadata = self._read_metadata()
-            existing_files = {f.name for f in self.storage_path.iterdir() if f.is_file()}
+        with self._process_lock(), self.lock:
+            # Scan under the locks so a concurrent record_upload (file written
+            # first, then recorded) can never look orphaned
+            with os.scandir(self.storage_path) as it:
+                existing_files = {e.name for e in it if e.is_file()}
 
             # Find metadata entries without corresponding files
             orphaned = [
-                filename for filename in metadata.keys()
-                if filename not in existing_files and filename != "uploads_metadata.json"
+                filename for filename in self._list_filenames()
+                if filename not in existing_files
+                and filename not in ("uploads_metadata.json", "uploads_metadata.jsonl")
             ]
 
-            # Remove orphaned entries
-            for filename in orphaned:
-                del metadata[filename]
-
+            # Remove orphaned entries (tombstoned in the log)
             if orphaned:
-                self._write_metadata(metadata)
+                self._append_log([
+                    self._log_line(filename, {"deleted": True}) for filename in orphaned
+                ])
+                if self._snapshot is not None:
+                    removed = set(orphaned)
+                    self._snapshot = {
+                        k: v for k, v in self._snapshot.items() if k not in removed
+                    }
+                self._dirty = True
+            elif not self._dirty:
+                return 0
+
+            # The view rewrite needs full entries; load them if not yet cached
+            self._read_metadata()
 
-            return len(orphaned)
+        self.flush()
+        return len(orphaned)
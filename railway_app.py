@@ -3,21 +3,33 @@
 Railway-optimized version that serves both gallery and upload on same port
 """
 
+import asyncio
+import gzip
+from email.utils import formatdate
 import os
 import shutil
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from stat import S_ISREG
 from typing import List
-import uuid
-import io
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, status, Request
+import hashlib
+import hmac
+import mimetypes
+from functools import lru_cache
+import tempfile
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Query, status, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, FileResponse
+from starlette.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, FileResponse, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from PIL import Image
 import pillow_heif
-from metadata_store import MetadataStore
+from gallery_layout import layout_images
+from image_io import (
+    EXTENSION_FORMATS, detect_format, get_dimensions, make_thumbnail,
+    remove_orphaned_thumbnails, verify_image,
+)
+from metadata_store import MetadataStore, CONTENT_TYPES, IMAGE_EXTENSIONS, IMAGE_SUFFIXES, json_dumps
 
 # Register HEIF opener for iOS photos
 pillow_heif.register_heif_opener()
@@ -33,6 +45,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class StaticAwareGZipMiddleware(GZipMiddleware):
+    """GZip responses, except /static images which are already compressed"""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith("/static/"):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+# Compress JSON and other dynamic responses (pages come precompressed)
+app.add_middleware(StaticAwareGZipMiddleware, minimum_size=512)
+
 # Security
 security = HTTPBearer()
 UPLOAD_TOKEN = os.getenv("UPLOAD_TOKEN")
@@ -45,17 +69,190 @@ if not UPLOAD_TOKEN:
 SOURCE_DIR = Path("source")
 UPLOAD_DIR = SOURCE_DIR
 
+# Uploads are streamed to disk in chunks of this size
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Stored uploads must stay readable by a static server (e.g. nginx behind
+# STATIC_ACCEL_PREFIX) running as another user; temp files start out 0600
+UPLOAD_FILE_MODE = 0o644
+
+# PIL decoding runs in this pool so uploads don't block the event loop
+VERIFY_WORKERS = min(32, (os.cpu_count() or 1) * 2)
+_verify_executor = ThreadPoolExecutor(max_workers=VERIFY_WORKERS)
+
+# /api/layout results, keyed on (seed, width bucket) for the current listing
+LAYOUT_WIDTH_STEP = 50
+LAYOUT_CACHE_SIZE = 256
+_layout_cache = {"images": None, "layouts": {}}
+
+# Gallery/upload pages are static; let browsers and CDNs reuse them
+HTML_CACHE_CONTROL = "public, max-age=3600"
+
+# Downscaled WebP copies for the gallery, named <original filename>.webp
+THUMB_DIR = SOURCE_DIR / "thumbs"
+
+# Originals that make_thumbnail() couldn't handle, name -> mtime_ns, so a
+# bad file costs one decode per version rather than one per request
+THUMB_FAILURES_MAX = 1024
+_thumb_failures = {}
+
 # Ensure directories exist
 UPLOAD_DIR.mkdir(exist_ok=True)
+THUMB_DIR.mkdir(exist_ok=True)
 
 # Initialize metadata store
 metadata_store = MetadataStore(SOURCE_DIR)
 
-# Mount static files for gallery
-app.mount("/static", StaticFiles(directory="source"), name="static")
+# /api/images cache: listing keyed on the directory mtime, plus per-file
+# dimensions keyed on (mtime, size) so a rescan only opens new/changed files
+_image_cache = {"dir_mtime": None, "entries": {}, "images": [], "json": b"[]",
+                "etag": None, "last_modified": None}
+
+# JSON API responses may be stored but must be revalidated (ETag) before reuse
+API_CACHE_CONTROL = "no-cache"
+
+# Cold scans read headers concurrently; mixed disk/HEIC work, so oversubscribe
+PROBE_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+_probe_executor = ThreadPoolExecutor(max_workers=PROBE_WORKERS)
+
+# Uploaded images never change once written (new content gets a new name),
+# so they can be cached forever; anything else in source/ is revalidated
+STATIC_IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+STATIC_REVALIDATE_CACHE_CONTROL = "no-cache"
+_STATIC_ROOT = SOURCE_DIR.resolve()
+_THUMB_ROOT = THUMB_DIR.resolve()
+
+# Small files (thumbnails, the index) are kept in memory, keyed on
+# (path, mtime, size) so a rewritten file is never served stale
+STATIC_MEMORY_MAX_BYTES = 256 * 1024
+STATIC_MEMORY_ENTRIES = 256
+
+# Small text files (the static index.html, JSON) are also kept gzipped
+STATIC_GZIP_SUFFIXES = frozenset({".html", ".js", ".css", ".json", ".txt", ".svg"})
+
+# Behind nginx, set e.g. STATIC_ACCEL_PREFIX=/internal/static/ (an internal
+# location aliased to source/) to hand file bodies off with X-Accel-Redirect
+STATIC_ACCEL_PREFIX = os.getenv("STATIC_ACCEL_PREFIX")
+
+# Large files go out in 1 MiB reads (FileResponse defaults to 64 KiB), so
+# each body message costs Python one sixteenth as many loop iterations
+STATIC_FILE_CHUNK_SIZE = 1 << 20
+
+class ChunkedFileResponse(FileResponse):
+    """FileResponse that streams the body in STATIC_FILE_CHUNK_SIZE reads"""
+
+    chunk_size = STATIC_FILE_CHUNK_SIZE
+
+@lru_cache(maxsize=STATIC_MEMORY_ENTRIES)
+def _read_small_file(path: str, mtime_ns: int, size: int) -> bytes:
+    """File body, cached per version of the file"""
+    with open(path, "rb") as f:
+        return f.read()
+
+@lru_cache(maxsize=STATIC_MEMORY_ENTRIES)
+def _read_small_file_gzip(path: str, mtime_ns: int, size: int) -> bytes:
+    """Gzipped file body, compressed once per version of the file"""
+    return gzip.compress(_read_small_file(path, mtime_ns, size), compresslevel=9, mtime=0)
+
+def _thumbnail_path(filename):
+    """Where the gallery thumbnail for an uploaded file lives"""
+    return THUMB_DIR / f"{filename}.webp"
+
+def _note_thumbnail_failure(original: Path):
+    """Remember that this version of an original can't be thumbnailed"""
+    try:
+        mtime_ns = original.stat().st_mtime_ns
+    except OSError:
+        return
+    if len(_thumb_failures) >= THUMB_FAILURES_MAX:
+        _thumb_failures.pop(next(iter(_thumb_failures)), None)
+    _thumb_failures[original.name] = mtime_ns
+
+def _stat_thumbnail(path: Path):
+    """Stat a thumbnail, generating it from its original if it's missing"""
+    try:
+        return path.stat()
+    except FileNotFoundError:
+        # Uploads made before thumbnails existed get one on first request
+        original = _STATIC_ROOT / path.name.removesuffix(".webp")
+        if not original.name.lower().endswith(IMAGE_EXTENSIONS):
+            raise
+        original_stat = original.stat()
+        if not S_ISREG(original_stat.st_mode) or _thumb_failures.get(original.name) == original_stat.st_mtime_ns:
+            raise
+        try:
+            make_thumbnail(original, path)
+        except Exception:
+            _note_thumbnail_failure(original)
+            raise
+        return path.stat()
+
+# Plain def: resolve()/stat() hit the disk, so FastAPI runs this in its threadpool
+@app.api_route("/static/{name:path}", methods=["GET", "HEAD"])
+def static_file(name: str, request: Request):
+    """Serve a file from the source directory (HEAD: headers only)"""
+    path = (_STATIC_ROOT / name).resolve()
+    if path.parent not in (_STATIC_ROOT, _THUMB_ROOT) or path.name.startswith("."):
+        raise HTTPException(status_code=404, detail="Not Found")
+    try:
+        if path.parent == _THUMB_ROOT:
+            stat_result = _stat_thumbnail(path)
+        else:
+            stat_result = path.stat()
+    except Exception:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not S_ISREG(stat_result.st_mode):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    if path.suffix.lower() in IMAGE_EXTENSIONS:
+        cache_control = STATIC_IMMUTABLE_CACHE_CONTROL
+    else:
+        cache_control = STATIC_REVALIDATE_CACHE_CONTROL
+    etag = f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+    headers = {"Cache-Control": cache_control, "ETag": etag}
+    gzipped = (
+        stat_result.st_size <= STATIC_MEMORY_MAX_BYTES
+        and path.suffix.lower() in STATIC_GZIP_SUFFIXES
+        and not STATIC_ACCEL_PREFIX
+    )
+    if gzipped:
+        headers["Vary"] = "Accept-Encoding"
+        gzipped = "gzip" in request.headers.get("accept-encoding", "")
+        if gzipped:
+            etag = headers["ETag"] = etag[:-1] + '-gz"'
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    if STATIC_ACCEL_PREFIX:
+        # nginx sends the body itself (sendfile), Python only sets headers
+        headers["X-Accel-Redirect"] = STATIC_ACCEL_PREFIX + path.relative_to(_STATIC_ROOT).as_posix()
+        return Response(headers=headers)
+
+    media_type = CONTENT_TYPES.get(path.suffix.lower()) or mimetypes.guess_type(path.name)[0]
+    if stat_result.st_size <= STATIC_MEMORY_MAX_BYTES:
+        if gzipped:
+            body = _read_small_file_gzip(str(path), stat_result.st_mtime_ns, stat_result.st_size)
+            headers["Content-Encoding"] = "gzip"
+        else:
+            body = _read_small_file(str(path), stat_result.st_mtime_ns, stat_result.st_size)
+        headers["Last-Modified"] = formatdate(stat_result.st_mtime, usegmt=True)
+        if request.method == "HEAD":
+            headers["Content-Length"] = str(len(body))
+            return Response(media_type=media_type, headers=headers)
+        return Response(content=body, media_type=media_type, headers=headers)
+
+    # Passing stat_result saves FileResponse a second stat per request;
+    # passing the method makes it send only the headers for HEAD
+    return ChunkedFileResponse(
+        path,
+        stat_result=stat_result,
+        media_type=media_type,
+        headers=headers,
+        method=request.method,
+    )
 
 def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    if credentials.credentials != UPLOAD_TOKEN:
+    if not hmac.compare_digest(credentials.credentials.encode("utf-8"), UPLOAD_TOKEN.encode("utf-8")):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication token",
@@ -63,22 +260,53 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
         )
     return credentials
 
+def _copy_upload(src, dst, hasher):
+    """
+    Copy a spooled upload into dst, feeding the content hash
+
+    Runs as one worker-thread call per file rather than a round trip per
+    chunk. Returns (size in bytes, first 32 bytes).
+    """
+    size_bytes = 0
+    head = b""
+    while chunk := src.read(UPLOAD_CHUNK_SIZE):
+        if not head:
+            head = chunk[:32]
+        dst.write(chunk)
+        hasher.update(chunk)
+        size_bytes += len(chunk)
+    return size_bytes, head
+
+def _verify_image(path, head, extension):
+    """
+    Check that path is an image and return its (width, height)
+
+    The magic number is trusted when it agrees with the extension, so only
+    the header is parsed; a mismatch gets a full PIL open + verify.
+    """
+    detected = detect_format(head)
+    if detected is None:
+        raise ValueError("unrecognised image format")
+    if EXTENSION_FORMATS.get(extension) == detected:
+        return get_dimensions(path)
+    return verify_image(path)
+
 def cleanup_metadata():
-    """Clean up orphaned metadata entries"""
+    """Clean up orphaned metadata entries and thumbnails"""
     try:
         # Clean orphaned entries from uploads_metadata.json
         orphaned = metadata_store.cleanup_orphaned_metadata()
+        # Deleted images' thumbnails would otherwise stay servable
+        thumbnails = remove_orphaned_thumbnails(SOURCE_DIR)
         return {
             "success": True,
-            "orphaned_removed": orphaned
+            "orphaned_removed": orphaned,
+            "thumbnails_removed": thumbnails
         }
     except Exception as e:
         return {"success": False, "error": str(e)}
 
-@app.get("/", response_class=HTMLResponse)
-async def gallery():
-    """Serve the dynamic gallery page"""
-    return """
+GALLERY_HTML = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -121,24 +349,22 @@ async def gallery():
         </div>
 
         <script>
-        function shuffleArray(array) {
-            for (let i = array.length - 1; i > 0; i--) {
-                const j = Math.floor(Math.random() * (i + 1));
-                [array[i], array[j]] = [array[j], array[i]];
-            }
-            return array;
-        }
+        // The server caches one layout per (seed, width bucket); a small seed
+        // pool keeps the gallery varied while most loads hit that cache
+        const LAYOUT_SEEDS = 16;
 
         async function loadGallery() {
             const container = document.getElementById('container');
             
             try {
-                const response = await fetch('/api/images');
+                const screen_width = Math.floor(container.getBoundingClientRect().width);
+                const seed = Math.floor(Math.random() * LAYOUT_SEEDS);
+                const response = await fetch(`/api/layout?width=${screen_width}&seed=${seed}`);
                 if (!response.ok) throw new Error('Failed to load images');
                 
-                const data = await response.json();
+                const layout = await response.json();
                 
-                if (data.length === 0) {
+                if (layout.length === 0) {
                     container.innerHTML = `
                         <div class="empty-state">
                             <h2>📸 No Screenshots Yet</h2>
@@ -152,105 +378,39 @@ async def gallery():
                 // Clear loading message
                 container.innerHTML = '';
 
-                let key_values = shuffleArray(data);
-                const rect = container.getBoundingClientRect();
-                let screen_width = rect.width;
-
-                // Resize images for optimal display
-                const pairs = key_values.map(([key, [w, h]]) => {
-                    let goal_pixels = 500*300;
-                    let actual_pixels = w*h;
-                    if (actual_pixels/goal_pixels > 16) {
-                        return [parseInt(w/8), parseInt(h/8)];
-                    }
-                    if (actual_pixels/goal_pixels > 4) {
-                        return [parseInt(w/4), parseInt(h/4)];
-                    }
-                    return [parseInt(w/2), parseInt(h/2)];
-                }).map(([w, h]) => [(w+10) > screen_width ? screen_width-10 : w, h]);
-
-                // Gather text nodes for collision detection
-                const textNodes = [];
-                const treeWalker = document.createTreeWalker(
-                    document.body,
-                    NodeFilter.SHOW_TEXT,
-                    { acceptNode: (node) => node.textContent.trim() ? NodeFilter.FILTER_ACCEPT : NodeFilter.FILTER_REJECT }
-                );
-                while(treeWalker.nextNode()) textNodes.push(treeWalker.currentNode);
-
-                // Place images with collision detection
-                let positions = [];
+                // Positions come precomputed, so each frame creates as many
+                // images as fit in its budget, in step with rendering
+                const FRAME_BUDGET_MS = 8;
                 let i = 0;
-                let interval = setInterval(() => {
-                    let height = 600;
-                    let [w, h] = pairs[i];
-                    while (1) {
-                        let found_place = false;
-                        let w_max = screen_width-w;
-                        let h_max = height-h;
-                        for (let _ = 0; _ < 50; _++) {
-                            let a_left = Math.random() * w_max;
-                            let a_top = Math.random() * h_max;
-                            let a_right = a_left+w;
-                            let a_bottom = a_top+h;
-
-                            // Check intersection with other images
-                            let intersects = false;
-                            for (let j = 0; j < positions.length; j++) {
-                                let [b_left, b_top] = positions[j];
-                                let b_right = b_left + pairs[j][0];
-                                let b_bottom = b_top + pairs[j][1];
-                                if (a_left < b_right && a_right > b_left && a_bottom > b_top && a_top < b_bottom) {
-                                    intersects = true;
-                                    break;
-                                }
-                            }
-
-                            // Check intersection with text
-                            for (const node of textNodes) {
-                                const range = document.createRange();
-                                range.selectNodeContents(node);
-                                const rect = range.getBoundingClientRect();
-                                let node_top = rect.top + window.pageYOffset;
-                                let node_left = rect.left + window.pageXOffset;
-                                
-                                if (a_left < (node_left+rect.width) && a_right > node_left && a_bottom > node_top && a_top < (node_top+rect.height)) {
-                                    intersects = true;
-                                    break;
-                                }
-                            }
-
-                            if (!intersects) {
-                                found_place = true;
-                                positions.push([parseInt(a_left), parseInt(a_top)]);
-                                break;
-                            }
-                        }
-                        if (found_place) {
-                            break;
-                        } else {
-                            height += 50;
-                        }
-                    }
-
-                    // Create the image
+                function placeOne() {
+                    const [name, [x, y, w, h]] = layout[i];
+                    // Show the downscaled thumbnail; clicking opens the original
+                    let link = document.createElement("a");
+                    link.href = `/static/${name}`;
+                    link.target = "_blank";
                     let img = document.createElement("img");
-                    img.src = `/static/${key_values[i][0]}`;
-                    img.width = pairs[i][0];
-                    img.height = pairs[i][1];
-                    img.style.width = pairs[i][0] + 'px';
-                    img.style.height = pairs[i][1] + 'px';
+                    img.src = `/static/thumbs/${name}.webp`;
+                    // Files that couldn't be thumbnailed only have the original
+                    img.onerror = () => { img.onerror = null; img.src = `/static/${name}`; };
+                    img.width = w;
+                    img.height = h;
+                    img.style.width = w + 'px';
+                    img.style.height = h + 'px';
                     img.style.position = "absolute";
-                    img.style.top = positions[i][1] + 'px';
-                    img.style.left = positions[i][0] + 'px';
+                    img.style.top = y + 'px';
+                    img.style.left = x + 'px';
                     img.loading = "lazy";
-                    container.appendChild(img);
-
-                    i++;
-                    if (i == key_values.length) {
-                        clearInterval(interval);
-                    }
-                }, 100);
+                    link.appendChild(img);
+                    container.appendChild(link);
+                }
+                function placeFrame(frameStart) {
+                    do {
+                        placeOne();
+                        i++;
+                    } while (i < layout.length && performance.now() - frameStart < FRAME_BUDGET_MS);
+                    if (i < layout.length) requestAnimationFrame(placeFrame);
+                }
+                requestAnimationFrame(placeFrame);
 
             } catch (error) {
                 container.innerHTML = `
@@ -270,10 +430,7 @@ async def gallery():
     </html>
     """
 
-@app.get("/upload", response_class=HTMLResponse)
-async def upload_page():
-    """Serve the upload interface"""
-    return """
+UPLOAD_HTML = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -423,6 +580,130 @@ async def upload_page():
     </html>
     """
 
+def _prebuild_page(html):
+    """Encode and gzip a page once at import, tagging each variant by hash"""
+    body = html.strip().encode("utf-8")
+    etag = hashlib.blake2b(body, digest_size=8).hexdigest()
+    return {
+        "identity": (body, f'"{etag}"'),
+        "gzip": (gzip.compress(body, compresslevel=9, mtime=0), f'"{etag}-gz"'),
+    }
+
+_GALLERY_PAGE = _prebuild_page(GALLERY_HTML)
+_UPLOAD_PAGE = _prebuild_page(UPLOAD_HTML)
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    """True if the request's If-None-Match covers etag (weak comparison)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+def _page_response(request: Request, page):
+    """Serve prebuilt page bytes, or 304 if the client already has them"""
+    encoding = "gzip" if "gzip" in request.headers.get("accept-encoding", "") else "identity"
+    body, etag = page[encoding]
+    headers = {
+        "Cache-Control": HTML_CACHE_CONTROL,
+        "ETag": etag,
+        "Vary": "Accept-Encoding",
+    }
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    if encoding == "gzip":
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="text/html", headers=headers)
+
+@app.get("/", response_class=HTMLResponse)
+async def gallery(request: Request):
+    """Serve the dynamic gallery page"""
+    return _page_response(request, _GALLERY_PAGE)
+
+@app.get("/upload", response_class=HTMLResponse)
+async def upload_page(request: Request):
+    """Serve the upload interface"""
+    return _page_response(request, _UPLOAD_PAGE)
+
+async def _store_upload(file: UploadFile):
+    """
+    Stream, validate and store one upload
+
+    Returns (stored filename, None) on success or (None, error message).
+    """
+    try:
+        # Validate file type
+        if not file.content_type or not file.content_type.startswith('image/'):
+            return None, f"{file.filename}: Not an image file"
+
+        file_extension = Path(file.filename).suffix.lower()
+        if not file_extension:
+            file_extension = '.jpg'
+
+        # Stream the upload to a temp file in chunks so memory stays
+        # bounded by UPLOAD_CHUNK_SIZE regardless of the image size,
+        # hashing as we go so identical uploads map to the same name
+        tmp = tempfile.NamedTemporaryFile(
+            dir=UPLOAD_DIR, prefix=".upload-", suffix=".tmp", delete=False
+        )
+        hasher = hashlib.blake2b(digest_size=8)
+        loop = asyncio.get_running_loop()
+        try:
+            with tmp:
+                os.fchmod(tmp.fileno(), UPLOAD_FILE_MODE)
+                # Disk I/O and hashing release the GIL; keep them off the loop
+                size_bytes, head = await loop.run_in_executor(
+                    None, _copy_upload, file.file, tmp, hasher
+                )
+
+            unique_filename = f"{hasher.hexdigest()}{file_extension}"
+            file_path = UPLOAD_DIR / unique_filename
+
+            # Same content already stored: nothing to write or re-index
+            if file_path.exists():
+                os.unlink(tmp.name)
+                return unique_filename, None
+
+            # Validate it's actually an image and get dimensions
+            try:
+                dimensions = await loop.run_in_executor(
+                    _verify_executor, _verify_image, tmp.name, head, file_extension
+                )
+            except Exception:
+                os.unlink(tmp.name)
+                return None, f"{file.filename}: Invalid or corrupted image"
+
+            # Move into place atomically
+            os.replace(tmp.name, file_path)
+        except BaseException:
+            if os.path.exists(tmp.name):
+                os.unlink(tmp.name)
+            raise
+
+        # Downscale once now so the gallery never ships the full-size file;
+        # on failure the gallery falls back to the original
+        try:
+            await loop.run_in_executor(
+                _verify_executor, make_thumbnail, file_path, _thumbnail_path(unique_filename)
+            )
+        except Exception as e:
+            _note_thumbnail_failure(file_path)
+            print(f"Thumbnail failed for {unique_filename}: {e}")
+
+        # Record metadata
+        metadata_store.record_upload(
+            filename=unique_filename,
+            original_filename=file.filename,
+            size_bytes=size_bytes,
+            dimensions=dimensions,
+            content_type=file.content_type
+        )
+
+        return unique_filename, None
+
+    except Exception as e:
+        return None, f"{file.filename}: {str(e)}"
+
 @app.post("/api/upload")
 async def upload_files(
     files: List[UploadFile] = File(...),
@@ -432,56 +713,14 @@ async def upload_files(
     if not files:
         raise HTTPException(status_code=400, detail="No files provided")
     
-    uploaded_files = []
-    errors = []
-    
-    for file in files:
-        try:
-            # Validate file type
-            if not file.content_type or not file.content_type.startswith('image/'):
-                errors.append(f"{file.filename}: Not an image file")
-                continue
-            
-            # Read file content
-            content = await file.read()
-
-            # Validate it's actually an image and get dimensions
-            try:
-                img = Image.open(io.BytesIO(content))
-                dimensions = img.size  # (width, height)
-                img.verify()
-            except Exception:
-                errors.append(f"{file.filename}: Invalid or corrupted image")
-                continue
-
-            # Generate unique filename
-            file_extension = Path(file.filename).suffix.lower()
-            if not file_extension:
-                file_extension = '.jpg'
-
-            unique_filename = f"{uuid.uuid4()}{file_extension}"
-            file_path = UPLOAD_DIR / unique_filename
-
-            # Save file
-            with open(file_path, "wb") as f:
-                f.write(content)
-
-            # Record metadata
-            metadata_store.record_upload(
-                filename=unique_filename,
-                original_filename=file.filename,
-                size_bytes=len(content),
-                dimensions=dimensions,
-                content_type=file.content_type
-            )
-
-            uploaded_files.append(unique_filename)
-            
-        except Exception as e:
-            errors.append(f"{file.filename}: {str(e)}")
+    # Files in a batch are independent: stream and verify them concurrently
+    # so validation spreads across the verify pool's cores
+    results = await asyncio.gather(*(_store_upload(file) for file in files))
+    uploaded_files = [filename for filename, _ in results if filename]
+    errors = [error for _, error in results if error]
 
     # Clean up orphaned metadata
-    cleanup_result = cleanup_metadata()
+    cleanup_result = await asyncio.get_running_loop().run_in_executor(None, cleanup_metadata)
 
     response = {
         "uploaded_count": len(uploaded_files),
@@ -496,35 +735,137 @@ async def upload_files(
     
     return response
 
+def _probe_dimensions(path):
+    """Header-read dimensions for path, or None if it isn't a readable image"""
+    try:
+        return list(get_dimensions(path))
+    except Exception as e:
+        # Skip files that can't be opened as images
+        print(f"Skipping {os.path.basename(path)}: {e}")
+        return None
+
+def _scan_images(dir_mtime):
+    """Rescan SOURCE_DIR, reusing cached dimensions for unchanged files"""
+    cached_entries = _image_cache["entries"]
+    scanned = []
+    to_probe = []
+
+    with os.scandir(SOURCE_DIR) as it:
+        for entry in it:
+            # rpartition + frozenset avoids Path objects; is_file() uses d_type
+            _, dot, suffix = entry.name.rpartition('.')
+            if not dot or suffix.lower() not in IMAGE_SUFFIXES:
+                continue
+            if not entry.is_file(follow_symlinks=False):
+                continue
+
+            st = entry.stat()
+            signature = (st.st_mtime_ns, st.st_size)
+            cached = cached_entries.get(entry.name)
+            if cached is not None and cached[0] == signature:
+                scanned.append((entry.name, signature, cached[1]))
+            else:
+                # New or changed file: read its header below
+                to_probe.append(len(scanned))
+                scanned.append((entry.name, signature, entry.path))
+
+    # Header reads are independent blocking I/O, so overlap them
+    if to_probe:
+        paths = [scanned[i][2] for i in to_probe]
+        for i, dimensions in zip(to_probe, _probe_executor.map(_probe_dimensions, paths)):
+            name, signature, _ = scanned[i]
+            scanned[i] = (name, signature, dimensions)
+
+    images = []
+    entries = {}
+    for name, signature, dimensions in scanned:
+        if dimensions is None:
+            continue
+        entries[name] = (signature, dimensions)
+        images.append([name, dimensions])
+
+    # Files that disappeared are evicted by rebuilding the entries dict
+    _image_cache["dir_mtime"] = dir_mtime
+    _image_cache["entries"] = entries
+    _image_cache["images"] = images
+    # Serialized here, off the event loop, and reused until the next rescan
+    _image_cache["json"] = json_dumps(images)
+    # Weak: the gzip middleware may compress the body without changing the tag
+    _image_cache["etag"] = f'W/"{hashlib.blake2b(_image_cache["json"], digest_size=8).hexdigest()}"'
+    _image_cache["last_modified"] = formatdate(dir_mtime / 1e9, usegmt=True)
+
+    return images
+
+async def _current_images():
+    """The [name, [width, height]] listing, rescanning only after changes"""
+    # Ensure source directory exists
+    SOURCE_DIR.mkdir(exist_ok=True)
+
+    # Adding, removing or renaming a file bumps the directory mtime, so an
+    # unchanged mtime means the cached listing is still valid
+    dir_mtime = SOURCE_DIR.stat().st_mtime_ns
+    if dir_mtime == _image_cache["dir_mtime"]:
+        return _image_cache["images"]
+
+    # The directory walk and header reads are blocking; keep them off
+    # the event loop
+    return await asyncio.get_running_loop().run_in_executor(
+        None, _scan_images, dir_mtime
+    )
+
 @app.get("/api/images")
-async def list_images():
+async def list_images(request: Request):
     """Dynamically list all images with their dimensions"""
     try:
-        images = []
-        
-        # Ensure source directory exists
-        SOURCE_DIR.mkdir(exist_ok=True)
-        
-        # Scan for image files
-        image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.heic', '.heif'}
-        
-        for file_path in SOURCE_DIR.iterdir():
-            if file_path.is_file() and file_path.suffix.lower() in image_extensions:
-                try:
-                    # Open image to get dimensions
-                    with Image.open(file_path) as img:
-                        width, height = img.size
-                        images.append([file_path.name, [width, height]])
-                except Exception as e:
-                    # Skip files that can't be opened as images
-                    print(f"Skipping {file_path.name}: {e}")
-                    continue
-        
-        return images
-        
+        await _current_images()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error listing images: {str(e)}")
 
+    headers = {
+        "Cache-Control": API_CACHE_CONTROL,
+        "ETag": _image_cache["etag"],
+        "Last-Modified": _image_cache["last_modified"],
+    }
+    if _etag_matches(request, _image_cache["etag"]):
+        return Response(status_code=304, headers=headers)
+
+    # Pre-serialized bytes go straight out, no per-request JSON encoding
+    return Response(content=_image_cache["json"], media_type="application/json", headers=headers)
+
+@app.get("/api/layout")
+async def layout(
+    request: Request,
+    width: int = Query(..., ge=100, le=10000),
+    seed: int = Query(0, ge=0, le=1000),
+):
+    """Gallery positions as [name, [x, y, w, h]] for a page of this width"""
+    images = await _current_images()
+    listing_etag = _image_cache["etag"]
+
+    # A new listing (any upload/delete) invalidates every cached layout
+    if _layout_cache["images"] is not images:
+        _layout_cache["images"] = images
+        _layout_cache["layouts"] = {}
+    layouts = _layout_cache["layouts"]
+
+    # Bucket the width so nearby window sizes share a layout
+    bucket = width - width % LAYOUT_WIDTH_STEP
+    key = (seed, bucket)
+    if key not in layouts:
+        positions = await asyncio.get_running_loop().run_in_executor(
+            None, layout_images, images, bucket, seed
+        )
+        if len(layouts) >= LAYOUT_CACHE_SIZE:
+            layouts.pop(next(iter(layouts)))
+        layouts[key] = json_dumps(positions)
+
+    # A layout is fixed for a given listing, seed and width bucket
+    etag = f'{listing_etag[:-1]}-{seed}-{bucket}"'
+    headers = {"Cache-Control": API_CACHE_CONTROL, "ETag": etag}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=layouts[key], media_type="application/json", headers=headers)
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -534,7 +875,7 @@ async def health_check():
         
         # Count images
         try:
-            images = await list_images()
+            images = await _current_images()
             image_count = len(images)
         except:
             image_count = 0
@@ -553,7 +894,20 @@ if __name__ == "__main__":
     import uvicorn
     
     port = int(os.getenv("PORT", 8000))
-    print(f"🚀 Starting on port {port}")
+    # Each worker is a separate process with its own caches and thread pools,
+    # so uploads' CPU-bound steps run in parallel; capped by default to keep
+    # small containers within memory
+    workers = int(os.getenv("WEB_CONCURRENCY", min(4, os.cpu_count() or 1)))
+    # Past this many open connections per worker, new ones get a 503
+    limit_concurrency = int(os.getenv("LIMIT_CONCURRENCY", 64))
+    print(f"🚀 Starting on port {port} with {workers} worker(s)")
     print(f"🔑 Upload token: {UPLOAD_TOKEN}")
     
-    uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
+    # uvicorn[standard] picks uvloop and httptools automatically
+    uvicorn.run(
+        "railway_app:app",
+        host="0.0.0.0",
+        port=port,
+        workers=workers,
+        limit_concurrency=limit_concurrency,
+    )
\ No newline at end of file
@@ -2,25 +2,148 @@
 import os
 import sys
 import json
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 # Add parent directory's venv to path
 sys.path.insert(0, '/var/www/vibe-screenshots/venv/lib/python3.12/site-packages')
 
+# image_io lives in the repository root, one level up from source/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 try:
-    from PIL import Image
-    from pillow_heif import register_heif_opener
-    register_heif_opener()
+    # Registers the HEIF opener; already done if the caller imported it first
+    from image_io import get_dimensions
 except ImportError as e:
     print("Got import error", e)
     print("You need to install pillow and pillow-heif: `pip3 install pillow pillow-heif`")
     import sys; sys.exit(1);
 
-files = []
-for file in os.listdir("."):
+INDEX_FILENAME = "image_widths_heights.json"
+LOCK_FILENAME = ".image_widths_heights.lock"
+
+# Cold scans with at least this many unprobed files fan out to a process
+# pool; below it, worker start-up costs more than it saves
+PARALLEL_MIN_FILES = 64
+PROBE_CHUNKSIZE = 16
+
+# (name, mtime_ns, size) -> [width, height], or None for non-images; when
+# imported by a long-running server, repeat regenerations only open files
+# that are new or changed
+_dimension_cache = {}
+
+def _probe_dimensions(path):
+    """[width, height] of an image, or None if it isn't one"""
     try:
-        im = Image.open(file)
-        files.append([file, [im.width, im.height]])
+        return list(get_dimensions(path))
     except: # e.g. .DS_Store, calculater.py, file
-        continue
-json.dump(files, open("image_widths_heights.json", 'w'))
-print(f"Successfully created image_widths_heights.json with {len(files)} files.")
\ No newline at end of file
+        return None
+
+def _probe_all(paths):
+    """Probe paths, in parallel across processes when there are many"""
+    if len(paths) < PARALLEL_MIN_FILES:
+        return [_probe_dimensions(path) for path in paths]
+    # spawn, not fork: callers may be multi-threaded servers
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=context) as executor:
+        return list(executor.map(_probe_dimensions, paths, chunksize=PROBE_CHUNKSIZE))
+
+def _write_index(source_dir, files):
+    """Write the index beside itself and rename it into place, so readers never see a partial file"""
+    index_path = os.path.join(source_dir, INDEX_FILENAME)
+    # Dot-prefixed so scans skip it; pid + thread keep concurrent writers apart
+    tmp_path = os.path.join(source_dir, f".{INDEX_FILENAME}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(files, f)
+        os.replace(tmp_path, index_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+@contextmanager
+def _index_lock(source_dir):
+    """Serialize index updates across threads and server worker processes"""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(source_dir, LOCK_FILENAME), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def regenerate_widths_heights(source_dir="."):
+    """Write image_widths_heights.json for the images in source_dir and return the list"""
+    with _index_lock(source_dir):
+        return _regenerate(source_dir)
+
+def _regenerate(source_dir):
+    scanned = []
+    with os.scandir(source_dir) as it:
+        for entry in it:
+            if entry.name == INDEX_FILENAME:
+                continue  # rewritten below on every run
+            if entry.name.startswith('.'):
+                continue  # staged/rejected uploads, .DS_Store
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            scanned.append((entry.name, entry.path, (entry.name, st.st_mtime_ns, st.st_size)))
+
+    to_probe = [path for _, path, key in scanned if key not in _dimension_cache]
+    probed = dict(zip(to_probe, _probe_all(to_probe)))
+
+    files = []
+    seen = {}
+    for name, path, key in scanned:
+        dimensions = probed[path] if path in probed else _dimension_cache[key]
+        seen[key] = dimensions
+        if dimensions is not None:
+            files.append([name, dimensions])
+    # Rebuilding from this scan drops entries for deleted/changed files
+    _dimension_cache.clear()
+    _dimension_cache.update(seen)
+    _write_index(source_dir, files)
+    return files
+
+def add_widths_heights(new_files, source_dir="."):
+    """
+    Patch image_widths_heights.json with new [name, [width, height]] entries
+    and return the updated list
+
+    Existing entries are kept without reopening their images; entries whose
+    file is gone are dropped. Falls back to a full regeneration when the
+    index is missing or unreadable.
+    """
+    index_path = os.path.join(source_dir, INDEX_FILENAME)
+    # Held across read-modify-write so concurrent patches can't drop each other's entries
+    with _index_lock(source_dir):
+        try:
+            with open(index_path) as f:
+                files = json.load(f)
+        except (OSError, ValueError):
+            return _regenerate(source_dir)
+
+        with os.scandir(source_dir) as it:
+            present = {entry.name for entry in it}
+        added = {name for name, _ in new_files}
+        files = [item for item in files if item[0] in present and item[0] not in added]
+        files.extend([name, list(dimensions)] for name, dimensions in new_files)
+
+        _write_index(source_dir, files)
+    return files
+
+if __name__ == "__main__":
+    files = regenerate_widths_heights()
+    print(f"Successfully created image_widths_heights.json with {len(files)} files.")
@@ -42,7 +42,7 @@ GALLERY_PID=$!
 cd ..
 
 # Start upload server with auto-reload using watchdog
-watchdog auto-restart --directory=. --pattern="*.py" --recursive -- python3 upload_app.py &
+UPLOAD_PORT=8001 watchdog auto-restart --directory=. --pattern="*.py" --recursive -- python3 upload_app.py &
 UPLOAD_PID=$!
 
 # Wait for both processes
@@ -8,26 +8,73 @@ import os
 import sys
 import subprocess
 import signal
+import socket
 import time
 from pathlib import Path
 
+def port_in_use(port):
+    """True if something is already listening on port"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            s.bind(("", port))
+        except OSError:
+            return True
+    return False
+
+def listening_pids(port):
+    """PIDs of processes listening on port, read straight from /proc"""
+    inodes = set()
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table) as f:
+                next(f)  # header
+                for line in f:
+                    fields = line.split()
+                    local_port = int(fields[1].rsplit(":", 1)[1], 16)
+                    if local_port == port and fields[3] == "0A":  # LISTEN
+                        inodes.add(f"socket:[{fields[9]}]")
+        except OSError:
+            pass
+
+    pids = set()
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        fd_dir = f"/proc/{pid}/fd"
+        try:
+            for fd in os.listdir(fd_dir):
+                if os.readlink(f"{fd_dir}/{fd}") in inodes:
+                    pids.add(int(pid))
+                    break
+        except OSError:
+            continue  # exited, or not ours to inspect
+    return pids
+
 def kill_processes():
-    """Kill any existing processes on our ports"""
+    """Kill any existing processes on our ports; returns True if any were found"""
     ports = [8000, 8001]
+    found = False
     for port in ports:
-        try:
-            subprocess.run(
-                ["lsof", "-ti", f"tcp:{port}"], 
-                capture_output=True, 
-                check=False
-            )
-            subprocess.run(
-                ["pkill", "-f", f":{port}"], 
-                capture_output=True, 
+        # One bind() per free port; only busy ports need the owner looked up
+        if not port_in_use(port):
+            continue
+        found = True
+        if os.path.isdir("/proc/net"):
+            pids = listening_pids(port)
+        else:
+            # No procfs (macOS): fall back to lsof
+            result = subprocess.run(
+                ["lsof", "-ti", f"tcp:{port}"],
+                capture_output=True,
+                text=True,
                 check=False
             )
-        except:
-            pass
+            pids = {int(pid) for pid in result.stdout.split()}
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+    return found
 
 def signal_handler(sig, frame):
     """Handle Ctrl+C gracefully"""
@@ -39,9 +86,9 @@ def main():
     # Set up signal handler for graceful shutdown
     signal.signal(signal.SIGINT, signal_handler)
     
-    # Kill any existing processes
-    kill_processes()
-    time.sleep(1)
+    # Kill any existing processes, giving them a moment to release the ports
+    if kill_processes():
+        time.sleep(1)
     
     # Set default upload token if not provided
     if not os.getenv("UPLOAD_TOKEN"):
@@ -68,6 +115,7 @@ def main():
         upload_process = subprocess.Popen(
             ["watchdog", "auto-restart", "--directory=.", "--pattern=*.py", "--recursive", "--", 
              sys.executable, "upload_app.py"],
+            env={**os.environ, "UPLOAD_PORT": "8001"},
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE
         )
@@ -0,0 +1,23 @@
+import importlib
+import sys
+from pathlib import Path
+
+import pytest
+
+# The modules under test live at the repository root, not in a package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+UPLOAD_TOKEN = "test-token"
+
+
+@pytest.fixture
+def load_server(tmp_path, monkeypatch):
+    """Import a server module afresh, with its source/ directory under tmp_path"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("UPLOAD_TOKEN", UPLOAD_TOKEN)
+
+    def load(name):
+        sys.modules.pop(name, None)
+        return importlib.import_module(name)
+
+    return load
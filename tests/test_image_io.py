@@ -0,0 +1,107 @@
+import pytest
+from PIL import Image, ImageOps
+
+import image_io
+from image_io import detect_format, get_dimensions, probe_image
+
+SIZE = (37, 23)
+
+
+def _save(path, mode="RGB", **params):
+    # Translucent where there's alpha, so encoders can't drop the channel
+    color = (255, 0, 0, 128) if mode == "RGBA" else "red"
+    Image.new(mode, SIZE, color).save(path, **params)
+    return path
+
+
+# name -> (suffix, mode, save params, expected format)
+CASES = {
+    "jpeg": (".jpg", "RGB", {}, "jpeg"),
+    "jpeg-progressive-exif": (".jpg", "RGB", {"progressive": True, "exif": b"Exif\x00\x00" + b"\x00" * 64}, "jpeg"),
+    "png": (".png", "RGBA", {}, "png"),
+    "gif": (".gif", "P", {}, "gif"),
+    "bmp": (".bmp", "RGB", {}, "bmp"),
+    "webp-vp8": (".webp", "RGB", {"lossless": False}, "webp"),
+    "webp-vp8l": (".webp", "RGB", {"lossless": True}, "webp"),
+    "webp-vp8x": (".webp", "RGBA", {"lossless": False}, "webp"),
+}
+
+WEBP_CHUNKS = {"webp-vp8": b"VP8 ", "webp-vp8l": b"VP8L", "webp-vp8x": b"VP8X"}
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_header_dimensions_match_pil(tmp_path, monkeypatch, case):
+    suffix, mode, params, expected_format = CASES[case]
+    path = _save(tmp_path / f"img{suffix}", mode, **params)
+    if case in WEBP_CHUNKS:
+        assert path.read_bytes()[12:16] == WEBP_CHUNKS[case]
+
+    with Image.open(path) as img:
+        expected = img.size
+
+    # The header parsers must answer without falling back to PIL
+    def no_pil(*args, **kwargs):
+        raise AssertionError("fell back to PIL")
+    monkeypatch.setattr(image_io.Image, "open", no_pil)
+
+    assert probe_image(path) == (*expected, expected_format)
+    assert get_dimensions(path) == SIZE
+
+
+def test_heic_dimensions_match_pil(tmp_path):
+    path = _save(tmp_path / "img.heic", quality=50)
+    with Image.open(path) as img:
+        expected = img.size
+    assert probe_image(path) == (*expected, "heif")
+
+
+def test_unknown_format_is_not_detected():
+    assert detect_format(b"not an image at all, honestly!!") is None
+
+
+def _rotated_jpeg(path, orientation):
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    # EXIF-heavy phones write a large APP1 first; pad it so it's seeked past
+    exif[0x010E] = "x" * 2000
+    Image.new("RGB", (40, 20), "red").save(path, exif=exif.tobytes())
+    return path
+
+
+@pytest.mark.parametrize("orientation", [1, 3, 6, 8])
+def test_dimensions_follow_exif_orientation(tmp_path, orientation):
+    path = _rotated_jpeg(tmp_path / "img.jpg", orientation)
+    with Image.open(path) as img:
+        expected = ImageOps.exif_transpose(img).size
+    assert get_dimensions(path) == expected
+    assert image_io.verify_image(path) == expected
+
+
+@pytest.mark.parametrize("orientation", [1, 6])
+def test_thumbnail_is_rotated_like_the_listing(tmp_path, orientation):
+    path = _rotated_jpeg(tmp_path / "img.jpg", orientation)
+    thumb = tmp_path / "img.jpg.webp"
+    image_io.make_thumbnail(path, thumb)
+    with Image.open(thumb) as img:
+        assert img.size == get_dimensions(path)
+        assert img.getexif().get(0x0112) in (None, 1)
+
+
+def test_webp_with_exif_orientation(tmp_path):
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    path = tmp_path / "img.webp"
+    Image.new("RGB", SIZE, "red").save(path, exif=exif.tobytes())
+    assert get_dimensions(path) == SIZE[::-1]
+
+
+def test_remove_orphaned_thumbnails(tmp_path):
+    thumbs = tmp_path / image_io.THUMBNAIL_DIRNAME
+    thumbs.mkdir()
+    _save(tmp_path / "kept.png")
+    for name in ("kept.png.webp", "gone.png.webp", "gone.png.webp.123.456.tmp"):
+        (thumbs / name).write_bytes(b"x")
+
+    assert image_io.remove_orphaned_thumbnails(tmp_path) == 1
+    assert sorted(p.name for p in thumbs.iterdir()) == ["gone.png.webp.123.456.tmp", "kept.png.webp"]
+    assert image_io.remove_orphaned_thumbnails(tmp_path / "missing") == 0
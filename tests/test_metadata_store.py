@@ -0,0 +1,149 @@
+import json
+import multiprocessing
+
+import pytest
+
+from metadata_store import MetadataStore, json_dumps
+
+
+def _record(store, filename, size=1):
+    store.record_upload(filename, filename, size, (size, size), "image/png")
+
+
+def _write_log(tmp_path, lines):
+    (tmp_path / "uploads_metadata.jsonl").write_bytes(b"".join(lines))
+
+
+def _line(filename, **fields):
+    return json_dumps({"filename": filename, **fields}) + b"\n"
+
+
+def _view(tmp_path):
+    return json.loads((tmp_path / "uploads_metadata.json").read_text())
+
+
+def test_replay_keeps_latest_record_and_applies_tombstones(tmp_path):
+    _write_log(tmp_path, [
+        _line("a.png", size_bytes=1),
+        _line("b.png", size_bytes=2),
+        _line("a.png", size_bytes=3),
+        _line("b.png", deleted=True),
+        _line("c.png", size_bytes=4),
+    ])
+    store = MetadataStore(tmp_path)
+    assert store.get_all_metadata() == {
+        "a.png": {"size_bytes": 3},
+        "c.png": {"size_bytes": 4},
+    }
+
+
+def test_replay_skips_torn_last_line_and_next_append_terminates_it(tmp_path):
+    _write_log(tmp_path, [_line("a.png", size_bytes=1), b'{"filename":"b.png","size'])
+    store = MetadataStore(tmp_path)
+    assert set(store.get_all_metadata()) == {"a.png"}
+
+    _record(store, "c.png")
+    assert set(MetadataStore(tmp_path).get_all_metadata()) == {"a.png", "c.png"}
+
+
+@pytest.mark.parametrize("filename", ['quo"te.png', "back\\slash.png", "unié.png"])
+def test_escaped_filenames_round_trip(tmp_path, filename):
+    store = MetadataStore(tmp_path)
+    _record(store, filename)
+    _record(store, "other.png")
+    store.delete_metadata("other.png")
+
+    fresh = MetadataStore(tmp_path)
+    assert fresh.list_filenames() == {filename}
+    assert set(fresh.get_all_metadata()) == {filename}
+
+
+def test_list_filenames_matches_get_all_metadata(tmp_path):
+    _write_log(tmp_path, [
+        _line("a.png", size_bytes=1),
+        _line('q"uote.png', size_bytes=2),
+        _line("a.png", deleted=True),
+        _line("b\\.png", size_bytes=3),
+        _line("c.png", size_bytes=4),
+        _line("c.png", deleted=True),
+        _line("c.png", size_bytes=5),
+        b'{"filename":"torn-mid.png","size\n',
+        _line("d.png", size_bytes=6),
+        b'{"filename":"torn.png"',
+    ])
+    # Before the snapshot is loaded list_filenames() scans the raw log
+    fast = MetadataStore(tmp_path).list_filenames()
+    store = MetadataStore(tmp_path)
+    assert fast == set(store.get_all_metadata())
+    assert store.list_filenames() == set(store.get_all_metadata())
+
+
+def test_compact_drops_superseded_records(tmp_path):
+    store = MetadataStore(tmp_path)
+    for name in ("a.png", "b.png", "a.png"):
+        _record(store, name)
+    store.delete_metadata("b.png")
+    store.compact()
+
+    lines = (tmp_path / "uploads_metadata.jsonl").read_bytes().splitlines()
+    assert len(lines) == 1
+    assert set(MetadataStore(tmp_path).get_all_metadata()) == {"a.png"}
+    assert set(_view(tmp_path)) == {"a.png"}
+
+
+def test_stores_sharing_a_directory_see_each_others_writes(tmp_path):
+    first, second = MetadataStore(tmp_path), MetadataStore(tmp_path)
+    _record(first, "a.png")
+    first.flush()
+    _record(second, "b.png")
+    second.flush()
+
+    assert set(_view(tmp_path)) == {"a.png", "b.png"}
+    assert set(first.get_all_metadata()) == {"a.png", "b.png"}
+
+    # A compaction by one store (e.g. the cleanup CLI) replaces the log file
+    second.delete_metadata("a.png")
+    second.compact()
+    assert first.list_filenames() == {"b.png"}
+    _record(first, "c.png")
+    assert set(second.get_all_metadata()) == {"b.png", "c.png"}
+
+
+def test_orphan_cleanup_does_not_drop_other_stores_entries(tmp_path):
+    first, second = MetadataStore(tmp_path), MetadataStore(tmp_path)
+    (tmp_path / "a.png").write_bytes(b"a")
+    _record(first, "a.png")
+    _record(first, "gone.png")
+    (tmp_path / "b.png").write_bytes(b"b")
+    _record(second, "b.png")
+
+    assert first.cleanup_orphaned_metadata() == 1
+    assert set(_view(tmp_path)) == {"a.png", "b.png"}
+
+
+def _record_many(path, prefix, count):
+    store = MetadataStore(path)
+    for i in range(count):
+        _record(store, f"{prefix}{i}.png")
+        store.flush()
+
+
+def test_concurrent_processes_and_compaction(tmp_path):
+    ctx = multiprocessing.get_context("spawn")
+    workers = [
+        ctx.Process(target=_record_many, args=(tmp_path, f"w{n}-", 25)) for n in range(3)
+    ]
+    for worker in workers:
+        worker.start()
+    store = MetadataStore(tmp_path)
+    for _ in range(5):
+        store.compact()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+    expected = {f"w{n}-{i}.png" for n in range(3) for i in range(25)}
+    assert store.list_filenames() == expected
+    assert set(MetadataStore(tmp_path).get_all_metadata()) == expected
+    store.export_pretty()
+    assert set(_view(tmp_path)) == expected
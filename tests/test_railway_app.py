@@ -0,0 +1,59 @@
+import io
+import stat
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from conftest import UPLOAD_TOKEN
+
+AUTH = {"Authorization": f"Bearer {UPLOAD_TOKEN}"}
+
+
+def _png(size=(20, 10)):
+    buf = io.BytesIO()
+    Image.new("RGB", size, "red").save(buf, "PNG")
+    return buf.getvalue()
+
+
+@pytest.fixture
+def railway(load_server):
+    app = load_server("railway_app")
+    return app, TestClient(app.app)
+
+
+def test_uploads_are_world_readable(railway):
+    app, client = railway
+    response = client.post("/api/upload", headers=AUTH, files=[("files", ("a.png", _png(), "image/png"))])
+    assert response.status_code == 200
+    (name,) = response.json()["uploaded_files"]
+    assert stat.S_IMODE((app.UPLOAD_DIR / name).stat().st_mode) == 0o644
+
+
+@pytest.mark.parametrize("size", [(20, 10), (1200, 1000)])
+def test_static_head_matches_get(railway, size):
+    app, client = railway
+    # The large image goes out as a streamed file, the small one from memory
+    image = Image.effect_noise(size, 64).convert("RGB")
+    image.save(app.SOURCE_DIR / "a.png")
+
+    get = client.get("/static/a.png")
+    head = client.head("/static/a.png")
+    assert get.status_code == head.status_code == 200
+    assert head.content == b""
+    for header in ("content-length", "content-type", "etag", "cache-control"):
+        assert head.headers[header] == get.headers[header]
+    assert int(get.headers["content-length"]) == len(get.content)
+
+
+def test_upload_cleanup_removes_deleted_images_thumbnails(railway):
+    app, client = railway
+    files = [("files", ("a.png", _png(), "image/png"))]
+    (name,) = client.post("/api/upload", headers=AUTH, files=files).json()["uploaded_files"]
+    assert client.get(f"/static/thumbs/{name}.webp").status_code == 200
+
+    (app.UPLOAD_DIR / name).unlink()
+    files = [("files", ("b.png", _png((30, 10)), "image/png"))]
+    cleanup = client.post("/api/upload", headers=AUTH, files=files).json()["cleanup"]
+    assert cleanup["thumbnails_removed"] == 1
+    assert client.get(f"/static/thumbs/{name}.webp").status_code == 404
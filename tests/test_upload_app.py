@@ -0,0 +1,35 @@
+import io
+import stat
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from conftest import UPLOAD_TOKEN
+
+AUTH = {"Authorization": f"Bearer {UPLOAD_TOKEN}"}
+
+
+def _png(size=(20, 10)):
+    buf = io.BytesIO()
+    Image.new("RGB", size, "red").save(buf, "PNG")
+    return buf.getvalue()
+
+
+@pytest.fixture
+def upload_app(load_server):
+    return load_server("upload_app")
+
+
+def test_accepted_uploads_are_world_readable(upload_app):
+    # Leaving the client's context runs shutdown, which drains the validators
+    with TestClient(upload_app.app) as client:
+        response = client.post("/upload", headers=AUTH, files=[
+            ("files", ("a.png", _png(), "image/png")),
+            ("files", ("bad.png", b"not a png" * 10, "image/png")),
+        ])
+        assert response.status_code == 202
+        good, bad = response.json()["queued"]
+
+    assert stat.S_IMODE((upload_app.UPLOAD_DIR / good).stat().st_mode) == 0o644
+    assert stat.S_IMODE((upload_app.REJECTED_DIR / bad).stat().st_mode) == 0o600
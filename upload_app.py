@@ -1,17 +1,27 @@
+import asyncio
+import gzip
+import hashlib
+import hmac
+import multiprocessing
 import os
-import shutil
-import subprocess
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 from typing import List
-import uuid
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, status
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, status, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from PIL import Image
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, Response
 import pillow_heif
-from metadata_store import MetadataStore
+from image_io import (
+    detect_format, get_dimensions, make_thumbnail, remove_orphaned_thumbnails, verify_image,
+)
+from metadata_store import IMAGE_SUFFIXES, MetadataStore
+
+# lister.py lives in the gallery's source/ directory next to this module
+sys.path.insert(0, str(Path(__file__).resolve().parent / "source"))
+from lister import add_widths_heights, regenerate_widths_heights
 
 # Register HEIF opener for iOS photos
 pillow_heif.register_heif_opener()
@@ -27,452 +37,382 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress JSON responses; the upload page comes precompressed
+app.add_middleware(GZipMiddleware, minimum_size=512)
+
 # Security
-security = HTTPBearer()
 UPLOAD_TOKEN = os.getenv("UPLOAD_TOKEN", "your-secret-token-here")  # Change this!
+_UPLOAD_TOKEN_BYTES = UPLOAD_TOKEN.encode("utf-8")
+
+# The dev scripts run this on 8001, next to the gallery on 8000
+UPLOAD_PORT = int(os.getenv("UPLOAD_PORT", "8766"))
 
 # Paths
 SOURCE_DIR = Path("source")
 UPLOAD_DIR = SOURCE_DIR  # Images go directly to source directory
 
+# Uploads are streamed to disk in chunks of this size
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Accepted uploads must stay readable by the gallery's static server running
+# as another user; staged temp files start out 0600
+UPLOAD_FILE_MODE = 0o644
+
+# Uploads are accepted on their magic number plus a header parse; set
+# UPLOAD_FULL_VERIFY=1 to also run the full PIL verify() pass
+UPLOAD_FULL_VERIFY = os.getenv("UPLOAD_FULL_VERIFY", "").lower() in ("1", "true", "yes")
+
+# macOS has no fdatasync; fsync also flushes the (unneeded) metadata
+_fdatasync = getattr(os, "fdatasync", os.fsync)
+
+# Image validation (PIL/libheif, which release the GIL) gets one thread per core
+VERIFY_WORKERS = os.cpu_count() or 1
+_verify_executor = ThreadPoolExecutor(max_workers=VERIFY_WORKERS)
+
+# Hashing and copying uploads is disk-bound; a few threads keep the disk busy
+# without a large batch's copies thrashing it
+COPY_WORKERS = 4
+_copy_executor = ThreadPoolExecutor(max_workers=COPY_WORKERS)
+
+# The full verify pass is CPU-bound Python/PIL work, so with UPLOAD_FULL_VERIFY
+# it runs in one process per core instead (started with the app)
+_full_verify_pool = None
+
+# Uploads that fail validation are moved here instead of being deleted
+REJECTED_DIR = SOURCE_DIR / ".rejected"
+
+# Downscaled WebP copies the gallery shows in place of the originals
+THUMB_DIR = SOURCE_DIR / "thumbs"
+
+# Validated uploads are added to the image list at most once per window
+INDEX_DEBOUNCE_SECONDS = 2.0
+
 # Ensure directories exist
 UPLOAD_DIR.mkdir(exist_ok=True)
+REJECTED_DIR.mkdir(exist_ok=True)
+THUMB_DIR.mkdir(exist_ok=True)
 
 # Initialize metadata store
 metadata_store = MetadataStore(SOURCE_DIR)
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    if credentials.credentials != UPLOAD_TOKEN:
+async def verify_token(request: Request):
+    """Check the Authorization: Bearer token, in constant time"""
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authenticated")
+    if not hmac.compare_digest(token.encode("utf-8"), _UPLOAD_TOKEN_BYTES):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication token",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    return credentials
 
-def is_valid_image(file_content: bytes) -> bool:
-    """Check if uploaded file is a valid image"""
+def cleanup_metadata(new_files=()):
+    """Clean up orphaned metadata and add new uploads to the image list"""
     try:
-        Image.open(io.BytesIO(file_content))
-        return True
-    except Exception:
-        return False
-
-def cleanup_metadata():
-    """Clean up orphaned metadata and regenerate image list"""
-    try:
-        # Step 1: Clean orphaned entries from uploads_metadata.json
+        # Step 1: Clean orphaned entries from uploads_metadata.json, and
+        # thumbnails of deleted images
         orphaned = metadata_store.cleanup_orphaned_metadata()
+        thumbnails = remove_orphaned_thumbnails(SOURCE_DIR)
 
-        # Step 2: Regenerate image_widths_heights.json
-        result = subprocess.run(
-            ["/var/www/vibe-screenshots/venv/bin/python3", "lister.py"],
-            cwd=SOURCE_DIR,
-            capture_output=True,
-            text=True,
-            check=True
-        )
+        # Step 2: Patch image_widths_heights.json with the new uploads only;
+        # /api/reindex rebuilds it from scratch
+        images = add_widths_heights(new_files, SOURCE_DIR)
 
         return {
             "success": True,
             "orphaned_removed": orphaned,
-            "output": result.stdout
+            "thumbnails_removed": thumbnails,
+            "output": f"Successfully updated image_widths_heights.json with {len(images)} files."
         }
-    except subprocess.CalledProcessError as e:
-        return {"success": False, "error": e.stderr}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+# The page never changes while the server runs: read it once and tag it
+UPLOAD_PAGE_PATH = Path(__file__).resolve().parent / "static" / "upload.html"
+UPLOAD_PAGE_BYTES = UPLOAD_PAGE_PATH.read_bytes().strip()
+UPLOAD_PAGE_ETAG = f'"{hashlib.blake2b(UPLOAD_PAGE_BYTES, digest_size=8).hexdigest()}"'
+# Compressed once here, so serving it costs no per-request CPU
+UPLOAD_PAGE_GZIP = gzip.compress(UPLOAD_PAGE_BYTES, compresslevel=9, mtime=0)
+UPLOAD_PAGE_GZIP_ETAG = UPLOAD_PAGE_ETAG[:-1] + '-gz"'
+HTML_CACHE_CONTROL = "public, max-age=3600"
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    """True if the request's If-None-Match covers etag"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
 @app.get("/", response_class=HTMLResponse)
-async def upload_page():
+async def upload_page(request: Request):
     """Serve the upload interface"""
-    return """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Screenshot Upload</title>
-        <meta name="viewport" content="width=device-width, initial-scale=1">
-        <style>
-            * { box-sizing: border-box; }
-            body {
-                font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, sans-serif;
-                max-width: 800px; margin: 0 auto; padding: 20px;
-                background: #f5f5f5;
-                -webkit-text-size-adjust: 100%;
-            }
-            h1 {
-                text-align: center; margin-bottom: 10px;
-            }
-            .upload-area {
-                border: 3px dashed #ccc; border-radius: 10px;
-                padding: 40px; text-align: center; margin: 20px 0;
-                background: white; cursor: pointer; transition: all 0.3s;
-            }
-            .upload-area:hover, .upload-area.drag-over {
-                border-color: #007bff; background: #f8f9fa;
-            }
-            .file-input { display: none; }
-            .upload-btn {
-                background: #007bff; color: white; border: none;
-                padding: 12px 24px; border-radius: 6px; cursor: pointer;
-                font-size: 16px; margin: 10px;
-            }
-            .upload-btn:hover { background: #0056b3; }
-            .paste-btn { background: #6c757d; }
-            .paste-btn:hover { background: #5a6268; }
-            .status {
-                margin: 10px 0; padding: 10px; border-radius: 4px;
-                display: none;
-            }
-            .preview-container {
-                display: flex; flex-wrap: wrap; gap: 10px; margin: 20px 0;
-            }
-            .preview-item {
-                position: relative; border: 2px solid #ddd; border-radius: 8px;
-                padding: 5px; background: white; max-width: 200px;
-            }
-            .preview-item img {
-                width: 100%; height: auto; border-radius: 4px;
-            }
-            .preview-remove {
-                position: absolute; top: -8px; right: -8px;
-                background: #dc3545; color: white; border: none;
-                border-radius: 50%; width: 24px; height: 24px;
-                cursor: pointer; font-size: 14px; line-height: 1;
-            }
-            .preview-remove:hover { background: #c82333; }
-            .success { background: #d4edda; color: #155724; border: 1px solid #c3e6cb; }
-            .error { background: #f8d7da; color: #721c24; border: 1px solid #f5c6cb; }
-            .token-input {
-                width: 100%; padding: 12px; margin: 10px 0;
-                border: 1px solid #ddd; border-radius: 4px; font-size: 16px;
-            }
-            .paste-area {
-                width: 100%; min-height: 120px; padding: 15px;
-                border: 2px dashed #007bff; border-radius: 8px;
-                background: #f8f9fa; margin: 15px 0;
-                font-size: 16px; resize: vertical;
-                font-family: inherit;
-            }
-            .paste-area:focus {
-                outline: none; border-color: #0056b3;
-                background: white;
-            }
-            .paste-instruction {
-                text-align: center; color: #6c757d;
-                margin: 10px 0; font-size: 14px;
-            }
-            @media (max-width: 600px) {
-                body { padding: 10px; }
-                .upload-area { padding: 20px; }
-                .upload-btn {
-                    padding: 14px 20px; font-size: 16px;
-                    width: 100%; margin: 5px 0;
-                }
-                h1 { font-size: 24px; }
-                .preview-item { max-width: 150px; }
-            }
-        </style>
-    </head>
-    <body>
-        <h1>📸 Screenshot Upload</h1>
-
-        <div>
-            <input type="password" id="token" class="token-input"
-                   placeholder="Enter upload token" autocomplete="off">
-        </div>
-
-        <!-- Mobile-friendly paste area -->
-        <div class="paste-instruction">
-            📋 <strong>Paste images here</strong> (tap and hold to paste on mobile)
-        </div>
-        <textarea id="pasteArea" class="paste-area"
-                  placeholder="Tap here and paste your screenshot... (long press and select Paste on mobile)"></textarea>
-
-        <div style="text-align: center; margin: 15px 0; color: #6c757d;">
-            — OR —
-        </div>
-
-        <div class="upload-area" id="uploadArea">
-            <h3>📤 Drop or select files</h3>
-            <p>Supports: JPG, PNG, HEIC, GIF, WebP</p>
-            <input type="file" id="fileInput" class="file-input"
-                   multiple accept="image/*">
-            <button class="upload-btn">Choose Files</button>
-        </div>
-
-        <div id="status" class="status"></div>
-
-        <div id="previews" style="margin: 20px 0;"></div>
-
-        <button id="submitBtn" class="upload-btn" style="display: none; width: 100%; background: #28a745;">
-            Upload Selected Images
-        </button>
-
-        <script>
-            const uploadArea = document.getElementById('uploadArea');
-            const fileInput = document.getElementById('fileInput');
-            const tokenInput = document.getElementById('token');
-            const status = document.getElementById('status');
-            const previews = document.getElementById('previews');
-            const submitBtn = document.getElementById('submitBtn');
-            const pasteArea = document.getElementById('pasteArea');
-
-            let selectedFiles = [];
-
-            // Load saved token
-            tokenInput.value = localStorage.getItem('uploadToken') || '';
-
-            // Save token when changed
-            tokenInput.addEventListener('change', () => {
-                localStorage.setItem('uploadToken', tokenInput.value);
-            });
-
-            uploadArea.addEventListener('click', () => {
-                fileInput.click();
-            });
-
-            uploadArea.addEventListener('dragover', (e) => {
-                e.preventDefault();
-                uploadArea.classList.add('drag-over');
-            });
-
-            uploadArea.addEventListener('dragleave', () => {
-                uploadArea.classList.remove('drag-over');
-            });
-
-            uploadArea.addEventListener('drop', (e) => {
-                e.preventDefault();
-                uploadArea.classList.remove('drag-over');
-                addFiles(e.dataTransfer.files);
-            });
-
-            fileInput.addEventListener('change', (e) => {
-                addFiles(e.target.files);
-            });
-
-            // Paste area handler
-            pasteArea.addEventListener('paste', (e) => {
-                e.preventDefault();
-                const items = e.clipboardData.items;
-                let foundImage = false;
-                for (let item of items) {
-                    if (item.type.startsWith('image/')) {
-                        const file = item.getAsFile();
-                        if (file) {
-                            addFiles([file]);
-                            foundImage = true;
-                        }
-                    }
-                }
-                if (foundImage) {
-                    showStatus('✅ Image pasted! Review and click Upload.', 'success');
-                    pasteArea.value = '';
-                } else {
-                    showStatus('No image found in clipboard', 'error');
-                }
-            });
-
-            // Clear placeholder text on focus
-            pasteArea.addEventListener('focus', () => {
-                pasteArea.placeholder = 'Paste now...';
-            });
-
-            pasteArea.addEventListener('blur', () => {
-                pasteArea.placeholder = 'Tap here and paste your screenshot... (long press and select Paste on mobile)';
-            });
-
-            // Global paste handler for convenience
-            document.addEventListener('paste', (e) => {
-                // Skip if pasting in the textarea (it has its own handler)
-                if (e.target === pasteArea) return;
-
-                const items = e.clipboardData.items;
-                let foundImage = false;
-                for (let item of items) {
-                    if (item.type.startsWith('image/')) {
-                        const file = item.getAsFile();
-                        if (file) {
-                            addFiles([file]);
-                            foundImage = true;
-                        }
-                    }
-                }
-                if (foundImage) {
-                    showStatus('✅ Image pasted! Review and click Upload.', 'success');
-                }
-            });
-
-            function addFiles(files) {
-                for (let file of files) {
-                    if (file.type.startsWith('image/')) {
-                        selectedFiles.push(file);
-                    }
-                }
-                updatePreviews();
-            }
-
-            function updatePreviews() {
-                previews.innerHTML = '';
-                if (selectedFiles.length === 0) {
-                    submitBtn.style.display = 'none';
-                    return;
-                }
-
-                previews.className = 'preview-container';
-                selectedFiles.forEach((file, index) => {
-                    const reader = new FileReader();
-                    reader.onload = (e) => {
-                        const div = document.createElement('div');
-                        div.className = 'preview-item';
-                        div.innerHTML = `
-                            <img src="${e.target.result}" alt="${file.name}">
-                            <button class="preview-remove" data-index="${index}">×</button>
-                        `;
-                        previews.appendChild(div);
-                    };
-                    reader.readAsDataURL(file);
-                });
-
-                submitBtn.style.display = 'block';
-                fileInput.value = '';
-            }
-
-            previews.addEventListener('click', (e) => {
-                if (e.target.classList.contains('preview-remove')) {
-                    const index = parseInt(e.target.dataset.index);
-                    selectedFiles.splice(index, 1);
-                    updatePreviews();
-                }
-            });
-
-            submitBtn.addEventListener('click', async () => {
-                if (!tokenInput.value.trim()) {
-                    showStatus('Please enter your upload token', 'error');
-                    return;
-                }
-
-                if (selectedFiles.length === 0) {
-                    showStatus('No files selected', 'error');
-                    return;
-                }
-
-                const formData = new FormData();
-                selectedFiles.forEach(file => {
-                    formData.append('files', file);
-                });
-
-                try {
-                    submitBtn.disabled = true;
-                    showStatus('Uploading...', 'success');
-                    // Use relative path that works with nginx proxy
-                    const uploadPath = window.location.pathname.replace('/upload', '/api/upload');
-                    const response = await fetch(uploadPath, {
-                        method: 'POST',
-                        headers: {
-                            'Authorization': `Bearer ${tokenInput.value}`
-                        },
-                        body: formData
-                    });
-
-                    const result = await response.json();
-
-                    if (response.ok) {
-                        showStatus(`✅ Uploaded ${result.uploaded_count} files successfully!`, 'success');
-                        selectedFiles = [];
-                        updatePreviews();
-                    } else {
-                        showStatus(`❌ Error: ${result.detail}`, 'error');
-                    }
-                } catch (error) {
-                    showStatus(`❌ Upload failed: ${error.message}`, 'error');
-                } finally {
-                    submitBtn.disabled = false;
-                }
-            });
-
-            function showStatus(message, type) {
-                status.textContent = message;
-                status.className = `status ${type}`;
-                status.style.display = 'block';
-                setTimeout(() => status.style.display = 'none', 5000);
-            }
-        </script>
-    </body>
-    </html>
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        body, etag = UPLOAD_PAGE_GZIP, UPLOAD_PAGE_GZIP_ETAG
+    else:
+        body, etag = UPLOAD_PAGE_BYTES, UPLOAD_PAGE_ETAG
+    headers = {"Cache-Control": HTML_CACHE_CONTROL, "ETag": etag, "Vary": "Accept-Encoding"}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    if body is UPLOAD_PAGE_GZIP:
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="text/html", headers=headers)
+
+def _verify_image(path, head: bytes):
+    """Check that path is an image and return its (width, height)"""
+    if detect_format(head) is None:
+        raise ValueError("unrecognised image format")
+    return get_dimensions(path)
+
+async def _verify_upload(path, head: bytes):
+    """Validate a staged upload in the matching pool and return its (width, height)"""
+    loop = asyncio.get_running_loop()
+    if _full_verify_pool is None:
+        return await loop.run_in_executor(_verify_executor, _verify_image, path, head)
+    if detect_format(head) is None:
+        raise ValueError("unrecognised image format")
+    return await loop.run_in_executor(_full_verify_pool, verify_image, path)
+
+def _upload_extension(filename) -> str:
+    """Lower-cased image extension of an upload's name, or '.jpg' if it has no known one"""
+    stem, dot, suffix = (filename or "").rpartition('.')
+    suffix = suffix.lower()
+    if dot and stem and suffix in IMAGE_SUFFIXES:
+        return '.' + suffix
+    return '.jpg'
+
+def _hash_upload(src):
+    """Content hash of a spooled upload, leaving it positioned to be copied"""
+    start = src.tell()
+    hasher = hashlib.blake2b(digest_size=8)
+    while chunk := src.read(UPLOAD_CHUNK_SIZE):
+        hasher.update(chunk)
+    src.seek(start)
+    return hasher.hexdigest()
+
+def _copy_in_kernel(fd_in, fd_out, offset):
+    """Copy fd_in from offset to the end into fd_out without a userspace buffer"""
+    size_bytes = 0
+    try:
+        while n := os.copy_file_range(fd_in, fd_out, UPLOAD_CHUNK_SIZE, offset + size_bytes):
+            size_bytes += n
+    except OSError:
+        # e.g. EXDEV when the spool and source/ are on different filesystems
+        if size_bytes:
+            raise
+        while n := os.sendfile(fd_out, fd_in, offset + size_bytes, UPLOAD_CHUNK_SIZE):
+            size_bytes += n
+    return size_bytes
+
+def _copy_upload(src, dst):
     """
+    Copy a spooled upload into dst
 
-@app.post("/upload")
-async def upload_files(
-    files: List[UploadFile] = File(...),
-    _: HTTPAuthorizationCredentials = Depends(verify_token)
-):
-    """Upload multiple image files"""
-    if not files:
-        raise HTTPException(status_code=400, detail="No files provided")
-    
-    uploaded_files = []
-    errors = []
-    
-    for file in files:
+    Runs as one worker-thread call per file rather than a round trip per
+    chunk. Uploads Starlette has rolled over to disk are copied by the
+    kernel. Returns (size in bytes, first 32 bytes).
+    """
+    if getattr(src, "_rolled", False) and hasattr(os, "copy_file_range"):
+        src.flush()
+        offset = src.tell()
+        dst.flush()
+        head = os.pread(src.fileno(), 32, offset)
+        return _copy_in_kernel(src.fileno(), dst.fileno(), offset), head
+
+    size_bytes = 0
+    head = b""
+    while chunk := src.read(UPLOAD_CHUNK_SIZE):
+        if not head:
+            head = chunk[:32]
+        dst.write(chunk)
+        size_bytes += len(chunk)
+    return size_bytes, head
+
+def _persist_upload(src, dst):
+    """Copy a spooled upload into dst and make its data durable before it's listed"""
+    size_bytes, head = _copy_upload(src, dst)
+    dst.flush()
+    _fdatasync(dst.fileno())
+    return size_bytes, head
+
+# Streamed uploads wait here for the validator workers, created at startup:
+# (staging path, final filename, original filename, content type, size, head)
+_validation_queue = None
+
+# Filenames staged but not yet validated, so concurrent duplicates are stored once
+_queued_names = set()
+
+# Validated (filename, dimensions) not yet added to image_widths_heights.json
+_pending_index: list = []
+_index_task = None
+
+async def _stage_upload(file: UploadFile):
+    """
+    Stream one upload to a staging file and queue it for validation
+
+    Returns (stored filename, None) once queued or (None, error message).
+    """
+    try:
+        # Validate file type
+        if not file.content_type or not file.content_type.startswith('image/'):
+            return None, f"{file.filename}: Not an image file"
+
+        file_extension = _upload_extension(file.filename)
+
+        # Name by content hash, so a re-shared photo maps to the file it
+        # already has and skips the copy, validation and thumbnail
+        loop = asyncio.get_running_loop()
+        digest = await loop.run_in_executor(_copy_executor, _hash_upload, file.file)
+        unique_filename = f"{digest}{file_extension}"
+        if unique_filename in _queued_names or (UPLOAD_DIR / unique_filename).exists():
+            return unique_filename, None
+        # Claimed before the copy's await, so a concurrent duplicate sees it
+        _queued_names.add(unique_filename)
+
+        # Stream to a temp file next to the destination, so the upload is
+        # never held in memory and only appears under its name once valid
+        tmp = tempfile.NamedTemporaryFile(
+            dir=UPLOAD_DIR, prefix=".upload-", suffix=".tmp", delete=False
+        )
+        try:
+            with tmp:
+                size_bytes, head = await loop.run_in_executor(
+                    _copy_executor, _persist_upload, file.file, tmp
+                )
+        except BaseException:
+            _queued_names.discard(unique_filename)
+            os.unlink(tmp.name)
+            raise
+
+        _validation_queue.put_nowait(
+            (tmp.name, unique_filename, file.filename, file.content_type, size_bytes, head)
+        )
+        return unique_filename, None
+
+    except Exception as e:
+        return None, f"{file.filename}: {str(e)}"
+
+async def _validator():
+    """Validate queued uploads, moving good ones into place and bad ones aside"""
+    loop = asyncio.get_running_loop()
+    while True:
+        tmp_path, filename, original_filename, content_type, size_bytes, head = (
+            await _validation_queue.get()
+        )
         try:
-            # Validate file type
-            if not file.content_type or not file.content_type.startswith('image/'):
-                errors.append(f"{file.filename}: Not an image file")
-                continue
-            
-            # Read file content
-            content = await file.read()
-            
-            # Validate it's actually an image and get dimensions
             try:
-                img = Image.open(io.BytesIO(content))
-                dimensions = img.size  # (width, height)
-                img.verify()  # Verify it's not corrupted
+                dimensions = await _verify_upload(tmp_path, head)
             except Exception:
-                errors.append(f"{file.filename}: Invalid or corrupted image")
+                print(f"Rejected upload {original_filename} ({filename})")
+                os.replace(tmp_path, REJECTED_DIR / filename)
                 continue
 
-            # Generate unique filename to avoid conflicts
-            file_extension = Path(file.filename).suffix.lower()
-            if not file_extension:
-                file_extension = '.jpg'
-
-            unique_filename = f"{uuid.uuid4()}{file_extension}"
-            file_path = UPLOAD_DIR / unique_filename
+            # Move into place atomically (rejected files stay private)
+            os.chmod(tmp_path, UPLOAD_FILE_MODE)
+            os.replace(tmp_path, UPLOAD_DIR / filename)
 
-            # Save file
-            with open(file_path, "wb") as f:
-                f.write(content)
+            # Downscale once now so the gallery never ships the full-size file;
+            # without a thumbnail it falls back to the original
+            try:
+                await loop.run_in_executor(
+                    _verify_executor, make_thumbnail,
+                    UPLOAD_DIR / filename, THUMB_DIR / f"{filename}.webp"
+                )
+            except Exception as e:
+                print(f"Thumbnail failed for {filename}: {e}")
 
-            # Record metadata
             metadata_store.record_upload(
-                filename=unique_filename,
-                original_filename=file.filename,
-                size_bytes=len(content),
+                filename=filename,
+                original_filename=original_filename,
+                size_bytes=size_bytes,
                 dimensions=dimensions,
-                content_type=file.content_type
+                content_type=content_type
             )
-
-            uploaded_files.append(unique_filename)
-            
+            _pending_index.append((filename, dimensions))
+            _schedule_index_update()
         except Exception as e:
-            errors.append(f"{file.filename}: {str(e)}")
+            print(f"Failed to store upload {original_filename}: {e}")
+        finally:
+            _queued_names.discard(filename)
+            _validation_queue.task_done()
+
+def _schedule_index_update():
+    """Add pending uploads to the image list after the debounce window"""
+    global _index_task
+    if _index_task is None or _index_task.done():
+        _index_task = asyncio.create_task(_update_index())
+
+async def _update_index(delay=INDEX_DEBOUNCE_SECONDS):
+    """Wait out the debounce window, then patch the image list once for all arrivals"""
+    await asyncio.sleep(delay)
+    # Uploads validated while a batch is being written don't schedule a new
+    # task (this one isn't done yet), so keep going until none are left
+    while _pending_index:
+        new_files = _pending_index[:]
+        del _pending_index[:]
+        result = await asyncio.get_running_loop().run_in_executor(
+            None, cleanup_metadata, new_files
+        )
+        if not result["success"]:
+            print(f"Image list update failed: {result['error']}")
+
+@app.on_event("startup")
+async def start_validators():
+    """One validator task per verify thread, so the pool stays busy"""
+    global _validation_queue, _full_verify_pool
+    _validation_queue = asyncio.Queue()
+    if UPLOAD_FULL_VERIFY and _full_verify_pool is None:
+        # spawn, not fork: the server already has threads running
+        _full_verify_pool = ProcessPoolExecutor(
+            max_workers=VERIFY_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    for _ in range(VERIFY_WORKERS):
+        asyncio.create_task(_validator())
+
+@app.on_event("shutdown")
+async def flush_uploads():
+    """Finish queued validations and write the image list before exiting"""
+    global _full_verify_pool
+    await _validation_queue.join()
+    await _update_index(delay=0)
+    if _index_task is not None:
+        await _index_task
+    if _full_verify_pool is not None:
+        _full_verify_pool.shutdown()
+        _full_verify_pool = None
+
+@app.post("/upload", status_code=status.HTTP_202_ACCEPTED)
+async def upload_files(
+    files: List[UploadFile] = File(...),
+    _: None = Depends(verify_token)
+):
+    """Accept multiple image files; they are validated and listed in the background"""
+    if not files:
+        raise HTTPException(status_code=400, detail="No files provided")
+    
+    # Stream the batch concurrently; validation happens after the response
+    results = await asyncio.gather(*(_stage_upload(file) for file in files))
+    queued = [filename for filename, _ in results if filename]
+    errors = [error for _, error in results if error]
     
-    # Clean up metadata and regenerate the image list
-    cleanup_result = cleanup_metadata()
+    if errors and not queued:
+        raise HTTPException(status_code=400, detail="All uploads failed: " + "; ".join(errors))
     
-    response = {
-        "uploaded_count": len(uploaded_files),
-        "uploaded_files": uploaded_files,
+    return {
+        "queued": queued,
+        "uploaded_count": len(queued),
+        "uploaded_files": queued,
         "errors": errors,
-        "cleanup": cleanup_result
     }
-    
-    if errors and not uploaded_files:
-        raise HTTPException(status_code=400, detail="All uploads failed", headers=response)
-    
-    return response
+
+@app.post("/api/reindex")
+async def reindex(_: None = Depends(verify_token)):
+    """Rebuild image_widths_heights.json from every image in the source directory"""
+    images = await asyncio.get_running_loop().run_in_executor(
+        None, regenerate_widths_heights, SOURCE_DIR
+    )
+    return {"success": True, "image_count": len(images)}
 
 @app.get("/health")
 async def health_check():
@@ -481,11 +421,23 @@ async def health_check():
 
 if __name__ == "__main__":
     import uvicorn
-    import io
     
     print("🚀 Starting upload server...")
     print(f"📁 Upload directory: {UPLOAD_DIR.absolute()}")
     print(f"🔑 Upload token: {UPLOAD_TOKEN}")
-    print("🌐 Access upload interface at: http://localhost:8001")
+    print(f"🌐 Access upload interface at: http://localhost:{UPLOAD_PORT}")
     
-    uvicorn.run(app, host="0.0.0.0", port=8766)
\ No newline at end of file
+    # Worker processes share nothing but the disk: lister locks the image
+    # list, and MetadataStore locks the metadata log and replays the other
+    # workers' records before writing uploads_metadata.json
+    workers = int(os.getenv("WEB_CONCURRENCY", min(4, os.cpu_count() or 1)))
+    limit_concurrency = int(os.getenv("LIMIT_CONCURRENCY", 64))
+
+    # uvicorn[standard] picks uvloop and httptools automatically
+    uvicorn.run(
+        "upload_app:app",
+        host="0.0.0.0",
+        port=UPLOAD_PORT,
+        workers=workers,
+        limit_concurrency=limit_concurrency,
+    )
\ No newline at end of file